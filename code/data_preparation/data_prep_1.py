@@ -1,13 +1,12 @@
 # This script merges and consolidates the beacons and sessions datasets into 1 dataset
 
-from pandarallel import pandarallel
 import pandas as pd
 import datetime
 import sys
 import os
-
-
-pandarallel.initialize(progress_bar=False, nb_workers=4)
+import module_consolidate
+import module_ingest
+import module_storage
 
 base_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -29,23 +28,29 @@ def df_info(df):
 #   We are simply going to check if an argument was supplied or not
 #   If not supplied, we shall execute processing stages 1, 2 & 3
 #   If supplied, we shall execute only stage 4
+#   If --stream is supplied, the beacons dataset is read and consolidated in bounded chunks
+#   and, as it is never fully loaded, all the stages 1, 2, 3 & 4 are executed in one run
+
+stream_mode = len(sys.argv) >= 2 and sys.argv[1] == '--stream'
+beacon_chunksize = 1000000
+
+if len(sys.argv) < 2 or stream_mode:
+    if not stream_mode:
+        # Reading the dataset b_3m and printing its basic summary
+        print('\n{}\tReading raw data: b_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        in_filename = '../data/sanitized/subset/b_3m.csv'
+        df_b = module_ingest.read_table('b', os.path.join(base_path, in_filename))
+        df_b_info = df_info(df_b)
+        print('\n{}\t"b_3m" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_b.shape[0], df_b.shape[1], df_b_info[1]))
+        print(df_b_info[0].to_string())
+        print('\n"b_3m" dataset head:')
+        print(df_b.head().to_string())
 
-if len(sys.argv) < 2:
-    # Reading the dataset b_3m and printing its basic summary
-    print('\n{}\tReading raw data: b_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    in_filename = '../data/sanitized/subset/b_3m.csv'
-    df_b = pd.read_csv(os.path.join(base_path, in_filename))
-    df_b_info = df_info(df_b)
-    print('\n{}\t"b_3m" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_b.shape[0], df_b.shape[1], df_b_info[1]))
-    print(df_b_info[0].to_string())
-    print('\n"b_3m" dataset head:')
-    print(df_b.head().to_string())
-    
     # Reading the dataset s and printing its basic summary
     print('\n{}\tReading raw data: s.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
     in_filename = '../data/sanitized/s.csv'
-    df_s = pd.read_csv(os.path.join(base_path, in_filename))
+    df_s = module_ingest.read_table('s', os.path.join(base_path, in_filename))
     df_s_info = df_info(df_s)
     print('\n{}\t"s" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
     print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_s.shape[0], df_s.shape[1], df_s_info[1]))
@@ -55,26 +60,26 @@ if len(sys.argv) < 2:
 
     ######################
 
-    # Dropping null values and converting column types for dataset b
-    print('\n{}\tProcessing stage 1: "b_3m" dataset: dropping rows with na, converting column types ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_b.dropna(inplace=True)
-    df_b.uuid = df_b.uuid.parallel_apply(lambda x: str(int(x)))
-    df_b.beacon_value = df_b.beacon_value.parallel_apply(lambda x: int(x))
-    df_b_info = df_info(df_b)
-    print('\n{}\t"b_3m" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_b.shape[0], df_b.shape[1], df_b_info[1]))
-    print(df_b_info[0].to_string())
-    print('\n"b_3m" dataset head:')
-    print(df_b.head().to_string())
-    
+    if not stream_mode:
+        # Dropping null values and converting column types for dataset b
+        print('\n{}\tProcessing stage 1: "b_3m" dataset: dropping rows with na, converting column types ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        df_b.dropna(inplace=True)
+        df_b.uuid = df_b.uuid.astype('int64')
+        df_b.beacon_value = df_b.beacon_value.astype('int64')
+        df_b_info = df_info(df_b)
+        print('\n{}\t"b_3m" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_b.shape[0], df_b.shape[1], df_b_info[1]))
+        print(df_b_info[0].to_string())
+        print('\n"b_3m" dataset head:')
+        print(df_b.head().to_string())
+
     # Dropping null values and converting column types for dataset s
     print('\n{}\tProcessing stage 1: "s" dataset: dropping rows with na, dropping columns, converting column types ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
     df_s.dropna(inplace=True)
     df_s.drop(columns=['status'], inplace=True)
-    df_s.uuid = df_s.uuid.parallel_apply(lambda x: str(int(x)))
-    df_s.phone = df_s.phone.parallel_apply(lambda x: str(int(x)))
-    df_s.email = df_s.email.parallel_apply(lambda x: str(int(x)))
-    df_s.log_date = df_s.log_date.parallel_apply(lambda x: datetime.datetime.strptime(x[:10], '%Y-%m-%d').date())
+    df_s.uuid = df_s.uuid.astype('int64')
+    df_s.phone = df_s.phone.astype('int64')
+    df_s.email = df_s.email.astype('int64')
     df_s_info = df_info(df_s)
     print('\n{}\t"s" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
     print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_s.shape[0], df_s.shape[1], df_s_info[1]))
@@ -86,22 +91,16 @@ if len(sys.argv) < 2:
 
     print('\n{}\tProcessing stage 2: consolidating "b_3m" dataset by date and uuid ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
     
-    # Preparing to consolidate the dataset b_3m
-    df_b_gb_date_uuid = df_b.groupby(['log_date', 'uuid'])
-    df_b_cb_date_uuid = pd.DataFrame(df_b_gb_date_uuid.groups.keys(), columns=['date', 'uuid'])
+    if stream_mode:
+        # Stages 1 & 2 are applied chunk by chunk and the partial consolidations are merged
+        print('{}\t\tStreaming b_3m.csv in chunks of {} rows ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), beacon_chunksize))
+        in_filename = '../data/sanitized/subset/b_3m.csv'
+        df_b_cb_date_uuid = module_consolidate.stream_consolidate_beacons(os.path.join(base_path, in_filename), chunksize=beacon_chunksize)
+    else:
+        # Consolidating all the beacon features of each (log_date, uuid) group in a single grouped pass
+        print('{}\t\tConsolidating sum_beacon_value, nunique_beacon_type, count_user_stay, count_pay_attempt, count_buy_click ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        df_b_cb_date_uuid = module_consolidate.consolidate_beacons(df_b)
 
-    # Feature consolidation
-    print('{}\t\tConsolidating sum_beacon_value ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_b_cb_date_uuid['sum_beacon_value'] = df_b_cb_date_uuid.parallel_apply(lambda x: df_b_gb_date_uuid.get_group((x[0], x[1]))['beacon_value'].values.sum(), axis=1)
-    print('{}\t\tConsolidating nunique_beacon_type ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_b_cb_date_uuid['nunique_beacon_type'] = df_b_cb_date_uuid.parallel_apply(lambda x: df_b_gb_date_uuid.get_group((x[0], x[1]))['beacon_type'].nunique(), axis=1)
-    print('{}\t\tConsolidating count_user_stay ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_b_cb_date_uuid['count_user_stay'] = df_b_cb_date_uuid.parallel_apply(lambda x: (df_b_gb_date_uuid.get_group((x[0], x[1]))['beacon_type'].values == 'user_stay').sum(), axis=1)
-    print('{}\t\tConsolidating count_pay_attempt ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_b_cb_date_uuid['count_pay_attempt'] = df_b_cb_date_uuid.parallel_apply(lambda x: df_b_gb_date_uuid.get_group((x[0], x[1]))['beacon_type'].str.contains('pay').sum(), axis=1)
-    print('{}\t\tConsolidating count_buy_click ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_b_cb_date_uuid['count_buy_click'] = df_b_cb_date_uuid.parallel_apply(lambda x: df_b_gb_date_uuid.get_group((x[0], x[1]))['beacon_type'].str.contains('buy|bottom').sum(), axis=1)
-    
     # Printing the summary of the consolidated beacons table
     df_b_cb_date_uuid_info = df_info(df_b_cb_date_uuid)
     print('\n{}\t"b_3m_cb_date_uuid" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
@@ -118,7 +117,7 @@ if len(sys.argv) < 2:
     df_bs_merged = df_b_cb_date_uuid.merge(df_s.drop(columns=['log_date']), on='uuid', how='inner')
 
     out_filename = '../data/sanitized/processed_base/bs_merged_3m.csv'
-    df_bs_merged.to_csv(os.path.join(base_path, out_filename), index=False)
+    module_storage.write_stage(df_bs_merged, os.path.join(base_path, out_filename))
 
     df_bs_merged_info = df_info(df_bs_merged)
     print('\n{}\t"bs_merged" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
@@ -127,52 +126,35 @@ if len(sys.argv) < 2:
     print('\n"bs_merged" dataset head:')
     print(df_bs_merged.head().to_string())
 
-else:
-    
-    # Reading the consolidated dataset and printing its summary
-    print('\n{}\tReading dataset: bs_merged_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    in_filename = '../data/sanitized/processed_base/bs_merged_3m.csv'
-    df_bs_merged = pd.read_csv(os.path.join(base_path, in_filename))
-    df_bs_merged_info = df_info(df_bs_merged)
-    print('\n{}\t"bs_merged" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_bs_merged.shape[0], df_bs_merged.shape[1], df_bs_merged_info[1]))
-    print(df_bs_merged_info[0].to_string())
-    print('\n"bs_merged" dataset head:')
-    print(df_bs_merged.head().to_string())
+    if stream_mode:
+        # Releasing the inputs of stage 3 before stage 4 runs in the same process
+        del df_s, df_b_cb_date_uuid
+
+if len(sys.argv) >= 2:
+    if not stream_mode:
+        # Reading the consolidated dataset and printing its summary
+        print('\n{}\tReading dataset: bs_merged_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        in_filename = '../data/sanitized/processed_base/bs_merged_3m.csv'
+        df_bs_merged = module_storage.read_stage(os.path.join(base_path, in_filename))
+        df_bs_merged_info = df_info(df_bs_merged)
+        print('\n{}\t"bs_merged" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_bs_merged.shape[0], df_bs_merged.shape[1], df_bs_merged_info[1]))
+        print(df_bs_merged_info[0].to_string())
+        print('\n"bs_merged" dataset head:')
+        print(df_bs_merged.head().to_string())
 
     ######################
     
     # Consolidating the merged dataset by date and email
     print('\n{}\tProcessing stage 4: consolidating "bs_merged" dataset by date and email ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 
-    df_bs_merged_gb_date_email = df_bs_merged.groupby(['date', 'email'])
-    df_bs_merged_cb_date_email = pd.DataFrame(df_bs_merged_gb_date_email.groups.keys(), columns=['date', 'email'])
-
-    print('{}\t\tConsolidating count_sessions ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['count_sessions'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: len(df_bs_merged_gb_date_email.get_group((x[0], x[1]))), axis=1)
-    print('{}\t\tConsolidating sum_beacon_value ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['sum_beacon_value'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['sum_beacon_value'].values.sum(), axis=1)
-    print('{}\t\tConsolidating nunique_beacon_type ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['nunique_beacon_type'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['nunique_beacon_type'].values.sum(), axis=1)
-    print('{}\t\tConsolidating count_user_stay ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['count_user_stay'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['count_user_stay'].values.sum(), axis=1)
-    print('{}\t\tConsolidating count_pay_attempt ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['count_pay_attempt'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['count_pay_attempt'].values.sum(), axis=1)
-    print('{}\t\tConsolidating count_buy_click ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['count_buy_click'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['count_buy_click'].values.sum(), axis=1)
-    print('{}\t\tConsolidating nunique_gender ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['nunique_gender'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['gender'].nunique(), axis=1)
-    print('{}\t\tConsolidating nunique_dob ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['nunique_dob'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['dob'].nunique(), axis=1)
-    print('{}\t\tConsolidating nunique_language ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['nunique_language'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['language'].nunique(), axis=1)
-    print('{}\t\tConsolidating nunique_report_type ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['nunique_report_type'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['report_type'].nunique(), axis=1)
-    print('{}\t\tConsolidating nunique_device ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    df_bs_merged_cb_date_email['nunique_device'] = df_bs_merged_cb_date_email.parallel_apply(lambda x: df_bs_merged_gb_date_email.get_group((x[0], x[1]))['device'].nunique(), axis=1)
+    # Rolling up every session feature of each (date, email) group in a single grouped pass
+    #   The nunique columns are computed over categorical codes instead of Python objects
+    print('{}\t\tConsolidating count_sessions, summed beacon features and nunique session features ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    df_bs_merged_cb_date_email = module_consolidate.consolidate_sessions(df_bs_merged)
 
     out_filename = '../data/sanitized/processed_base/bs_merged_consolidated_3m.csv'
-    df_bs_merged_cb_date_email.to_csv(os.path.join(base_path, out_filename), index=False)
+    module_storage.write_stage(df_bs_merged_cb_date_email, os.path.join(base_path, out_filename))
 
     df_bs_merged_cb_date_email_info = df_info(df_bs_merged_cb_date_email)
     print('\n{}\t"bs_merged_cb_date_email" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
@@ -1,13 +1,14 @@
 # This script merges and consolidates the customer, transaction and product datasets into 1 dataset
 
-from pandarallel import pandarallel
 import pandas as pd
 import datetime
+import sys
 import os
+import module_consolidate
+import module_ingest
+import module_storage
 
 
-pandarallel.initialize(progress_bar=False, nb_workers=4)
-
 base_path = os.path.dirname(os.path.realpath(__file__))
 
 def df_info(df):
@@ -24,10 +25,16 @@ def df_info(df):
 
 ######################
 
+# The merge and the consolidation can be run in partitions by hash of cid to cap the peak memory,
+#   the number of partitions can be supplied as an argument
+#   If not supplied, we shall merge and consolidate all the transactions at once
+
+n_partitions = int(sys.argv[1]) if len(sys.argv) >= 2 else 1
+
 # Summary and head of dataset ct_3m
 print('\n{}\tReading raw data: ct_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 in_filename = 'ct_3m.csv'
-df_ct = pd.read_csv(os.path.join(base_path, in_filename))
+df_ct = module_ingest.read_table('ct', os.path.join(base_path, in_filename))
 df_ct_info = df_info(df_ct)
 print('\n{}\t"ct_3m" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_ct.shape[0], df_ct.shape[1], df_ct_info[1]))
@@ -38,7 +45,8 @@ print(df_ct.head().to_string())
 # Summary and head of dataset c
 print('\n{}\tReading raw data: c.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 in_filename = 'c.csv'
-df_c = pd.read_csv(os.path.join(base_path, in_filename))
+# Only the columns used by the merge are read
+df_c = module_ingest.read_table('c', os.path.join(base_path, in_filename), usecols=['id', 'email', 'profile_submit_count'])
 df_c_info = df_info(df_c)
 print('\n{}\t"c" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_c.shape[0], df_c.shape[1], df_c_info[1]))
@@ -49,7 +57,8 @@ print(df_c.head().to_string())
 # Summary and head of dataset tp
 print('\n{}\tReading raw data: tp.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 in_filename = 'tp.csv'
-df_tp = pd.read_csv(os.path.join(base_path, in_filename))
+# Only the columns used by the merge are read
+df_tp = module_ingest.read_table('tp', os.path.join(base_path, in_filename), usecols=['ctid'])
 df_tp_info = df_info(df_tp)
 print('\n{}\t"tp" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_tp.shape[0], df_tp.shape[1], df_tp_info[1]))
@@ -59,52 +68,35 @@ print(df_tp.head().to_string())
 
 ######################
 
-print('\n{}\tProcessing stage 5: merging "c" and "tp" with "ct_3m" ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+if n_partitions == 1:
+    print('\n{}\tProcessing stage 5: merging "c" and "tp" with "ct_3m" ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 
-# Merging the tables c, ct and tp
-df_ct_merged = (((df_ct.merge(df_c.drop(columns=['primary_phone', 'secondary_phones']), left_on='cid', right_on='id', how='inner')).drop(columns=['id_y'])).merge(df_tp.drop(columns=['status']), left_on='id_x', right_on='ctid', how='inner')).drop(columns=['id_x'])
+    # Merging the tables c, ct and tp
+    df_ct_merged = module_consolidate.merge_transactions(df_ct, df_c, df_tp.ctid.value_counts())
 
-# Summary and head of the merged dataset.
-df_ct_merged_info = df_info(df_ct_merged)
-print('\n{}\t"ct_merged" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_ct_merged.shape[0], df_ct_merged.shape[1], df_ct_merged_info[1]))
-print(df_ct_merged_info[0].to_string())
-print('\n"ct_merged" dataset head:')
-print(df_ct_merged.head().to_string())
+    # Summary and head of the merged dataset.
+    df_ct_merged_info = df_info(df_ct_merged)
+    print('\n{}\t"ct_merged" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_ct_merged.shape[0], df_ct_merged.shape[1], df_ct_merged_info[1]))
+    print(df_ct_merged_info[0].to_string())
+    print('\n"ct_merged" dataset head:')
+    print(df_ct_merged.head().to_string())
 
-######################
+    ######################
 
-print('\n{}\tProcessing stage 6: consolidating "ct_merged" dataset by date and email ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    print('\n{}\tProcessing stage 6: consolidating "ct_merged" dataset by date and email ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 
-# Consolidating the merged dataset 
-df_ct_merged_gb_date_email = df_ct_merged.groupby(['timestamp', 'email'])
-df_ct_merged_cb_date_email = pd.DataFrame(df_ct_merged_gb_date_email.groups.keys(), columns=['date', 'email'])
+    # Consolidating the merged dataset in a single grouped pass
+    #   conversion_status collapses to Yes if any status of the group means a conversion, No otherwise
+    print('{}\t\tConsolidating conversion_status, profile_submit_count, transactions_amount ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    df_ct_merged_cb_date_email = module_consolidate.consolidate_conversions(df_ct_merged)
 
-def consolidate_conversion(x):
-    """
-    Collapses the conversion status to Yes or No.
-    """
-    xl = x.str.lower()
-    if any(xl.str.startswith('purchase')) or any(xl.str.startswith('converted')) or \
-            any(xl.str.startswith('y')) or any(xl.str.startswith('processed')) or \
-            any(xl.str.startswith('payment_completed')) or any(xl.str.startswith('initiated')) \
-            or any(xl.str.startswith('pdf_error')) or any(xl.str.startswith('toprocess')) \
-            or any(xl.str.startswith('delivered')):
-        return 'Y'
-    else:
-        return 'N'
-
-print('{}\t\tConsolidating conversion_status ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-# According to the consolidate_conversion function
-df_ct_merged_cb_date_email['conversion_status'] = df_ct_merged_cb_date_email.parallel_apply(lambda x: consolidate_conversion(df_ct_merged_gb_date_email.get_group((x[0], x[1]))['status']), axis=1)
-print('{}\t\tConsolidating profile_submit_count ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-# 
-df_ct_merged_cb_date_email['profile_submit_count'] = df_ct_merged_cb_date_email.parallel_apply(lambda x: df_ct_merged_gb_date_email.get_group((x[0], x[1])).iloc[0, 5], axis=1)
-print('{}\t\tConsolidating transactions_amount ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-df_ct_merged_cb_date_email['transactions_amount'] = df_ct_merged_cb_date_email.parallel_apply(lambda x: df_ct_merged_gb_date_email.get_group((x[0], x[1]))['amount'].values.sum(), axis=1)
+else:
+    print('\n{}\tProcessing stages 5 & 6: merging "c" and "tp" with "ct_3m" and consolidating by date and email in {} partitions ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), n_partitions))
+    df_ct_merged_cb_date_email = module_consolidate.consolidate_transactions_partitioned(df_ct, df_c, df_tp, n_partitions)
 
 out_filename = 'ct_merged_consolidated_3m.csv'
-df_ct_merged_cb_date_email.to_csv(os.path.join(base_path, out_filename), index=False)
+module_storage.write_stage(df_ct_merged_cb_date_email, os.path.join(base_path, out_filename))
 
 df_ct_merged_cb_date_email_info = df_info(df_ct_merged_cb_date_email)
 print('\n{}\t"ct_merged_cb_date_email" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
@@ -1,13 +1,13 @@
 # This script merges and consolidates the 2 datasets from data_prep_1 and dat_prep_2 into 1 dataset
 
-from pandarallel import pandarallel
 import pandas as pd
 import datetime
+import sys
 import os
+import module_label
+import module_storage
 
 
-pandarallel.initialize(progress_bar=False, nb_workers=4)
-
 base_path = os.path.dirname(os.path.realpath(__file__))
 
 def df_info(df):
@@ -24,61 +24,61 @@ def df_info(df):
 
 ######################
 
-print('\n{}\tReading dataset: bs_merged_consolidated_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-in_filename = '../data/sanitized/processed_base/bs_merged_consolidated_3m.csv'
-df_bs_merged_consolidated = pd.read_csv(os.path.join(base_path, in_filename))
-df_bs_merged_consolidated_info = df_info(df_bs_merged_consolidated)
-print('\n{}\t"bs_merged_consolidated" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_bs_merged_consolidated.shape[0], df_bs_merged_consolidated.shape[1], df_bs_merged_consolidated_info[1]))
-print(df_bs_merged_consolidated_info[0].to_string())
-print('\n"bs_merged_consolidated" dataset head:')
-print(df_bs_merged_consolidated.head().to_string())
-
-print('\n{}\tReading dataset: ct_merged_consolidated_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-in_filename = '../data/sanitized/processed_base/ct_merged_consolidated_3m.csv'
-df_ct_merged_consolidated = pd.read_csv(os.path.join(base_path, in_filename))
-df_ct_merged_consolidated_info = df_info(df_ct_merged_consolidated)
-print('\n{}\t"ct_merged_consolidated" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_ct_merged_consolidated.shape[0], df_ct_merged_consolidated.shape[1], df_ct_merged_consolidated_info[1]))
-print(df_ct_merged_consolidated_info[0].to_string())
-print('\n"ct_merged_consolidated" dataset head:')
-print(df_ct_merged_consolidated.head().to_string())
-label_value_counts = df_ct_merged_consolidated.conversion_status.value_counts()
-print('\n"ct_merged_consolidated.conversion_status" N = {}, Y = {}'.format(label_value_counts.loc['N'], label_value_counts.loc['Y']))
-print('"ct_merged_consolidated.profile_submit_count" min = {}, max = {}'.format(df_ct_merged_consolidated.profile_submit_count.min(), df_ct_merged_consolidated.profile_submit_count.max()))
-
-######################
-
-print('\n{}\tProcessing stage 7: merging "bs_merged_consolidated" and "ct_merged_consolidated" ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-
-df_ct_merged_consolidated_gb_email = df_ct_merged_consolidated.groupby(['email'])
-df_bs_ct_merged_consolidated = df_bs_merged_consolidated.copy()
-
-def merge_conversion(df_y, date_x):
-    """
-    Function to collapse the conversion status of each customer during a period of 3 days
-       starting the day the customer visited our website and submitted details for a free horoscope report
-    """
-    date_x = datetime.datetime.strptime(date_x, '%Y-%m-%d')
-    df_y.date = df_y.date.apply(lambda x: datetime.datetime.strptime(x, '%Y-%m-%d'))
-    date_x_plus_2 = date_x + datetime.timedelta(days=2)
-    if any((df_y.loc[(df_y.date >= date_x) & (df_y.date <= date_x_plus_2)]).conversion_status.str.startswith('Y')):
-        return 1
-    else:
-        return 0
-
-print('{}\t\tConsolidating conversion_status ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-# Consolidated keeping in mind the time window of 3 days
-df_bs_ct_merged_consolidated['conversion_status'] = df_bs_ct_merged_consolidated.parallel_apply(lambda x: merge_conversion(df_ct_merged_consolidated_gb_email.get_group(x['email'])[['date', 'conversion_status']], x['date']) if x['email'] in df_ct_merged_consolidated_gb_email.groups.keys() else 0, axis=1)
-print('{}\t\tConsolidating profile_submit_count ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-# Profile submit count is the same value for all the customers with same id (it's in the ct table)
-df_bs_ct_merged_consolidated['profile_submit_count'] = df_bs_ct_merged_consolidated.parallel_apply(lambda x: df_ct_merged_consolidated_gb_email.get_group(x['email']).iloc[0, 3] if x['email'] in df_ct_merged_consolidated_gb_email.groups.keys() else 0, axis=1)
-print('{}\t\tConsolidating transactions_amount ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-# Include the amount value if the record is present in the beacon-session table
-df_bs_ct_merged_consolidated['transactions_amount'] = df_bs_ct_merged_consolidated.parallel_apply(lambda x: df_ct_merged_consolidated_gb_email.get_group(x['email'])['transactions_amount'].values.sum() if x['email'] in df_ct_merged_consolidated_gb_email.groups.keys() else -1.0, axis=1)
+# The conversion window (in days, starting the day of the visit) can be supplied as an argument
+#   If not supplied, we shall use a window of 3 days
+#   If --relabel is supplied after the window, the conversion offsets stored by a previous run are
+#   reused and the visits are relabelled without joining the two datasets again
+
+window_days = int(sys.argv[1]) if len(sys.argv) >= 2 else 3
+relabel_mode = len(sys.argv) >= 3 and sys.argv[2] == '--relabel'
+offsets_filename = 'bs_ct_merged_offsets_3m.csv'
+
+if not relabel_mode:
+    print('\n{}\tReading dataset: bs_merged_consolidated_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    in_filename = '../data/sanitized/processed_base/bs_merged_consolidated_3m.csv'
+    df_bs_merged_consolidated = module_storage.read_stage(os.path.join(base_path, in_filename))
+    df_bs_merged_consolidated_info = df_info(df_bs_merged_consolidated)
+    print('\n{}\t"bs_merged_consolidated" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_bs_merged_consolidated.shape[0], df_bs_merged_consolidated.shape[1], df_bs_merged_consolidated_info[1]))
+    print(df_bs_merged_consolidated_info[0].to_string())
+    print('\n"bs_merged_consolidated" dataset head:')
+    print(df_bs_merged_consolidated.head().to_string())
+
+    print('\n{}\tReading dataset: ct_merged_consolidated_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    in_filename = '../data/sanitized/processed_base/ct_merged_consolidated_3m.csv'
+    df_ct_merged_consolidated = module_storage.read_stage(os.path.join(base_path, in_filename))
+    df_ct_merged_consolidated_info = df_info(df_ct_merged_consolidated)
+    print('\n{}\t"ct_merged_consolidated" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_ct_merged_consolidated.shape[0], df_ct_merged_consolidated.shape[1], df_ct_merged_consolidated_info[1]))
+    print(df_ct_merged_consolidated_info[0].to_string())
+    print('\n"ct_merged_consolidated" dataset head:')
+    print(df_ct_merged_consolidated.head().to_string())
+    label_value_counts = df_ct_merged_consolidated.conversion_status.value_counts()
+    print('\n"ct_merged_consolidated.conversion_status" N = {}, Y = {}'.format(label_value_counts.loc['N'], label_value_counts.loc['Y']))
+    print('"ct_merged_consolidated.profile_submit_count" min = {}, max = {}'.format(df_ct_merged_consolidated.profile_submit_count.min(), df_ct_merged_consolidated.profile_submit_count.max()))
+
+    ######################
+
+    print('\n{}\tProcessing stage 7: merging "bs_merged_consolidated" and "ct_merged_consolidated" ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+    # Joining every visit in one sorted pass over the (email, date) keys of both datasets
+    #   conversion_offset is the number of days to the next conversion of the customer, -1 if none
+    #   profile_submit_count is the same value for all the customers with same id (it's in the ct table)
+    #   transactions_amount includes the amount value if the record is present in the beacon-session table
+    print('{}\t\tConsolidating conversion_offset, profile_submit_count, transactions_amount ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    df_bs_ct_merged_offsets = module_label.add_conversion_offsets(df_bs_merged_consolidated, df_ct_merged_consolidated)
+    module_storage.write_stage(df_bs_ct_merged_offsets, os.path.join(base_path, offsets_filename))
+
+else:
+    print('\n{}\tReading dataset: bs_ct_merged_offsets_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    df_bs_ct_merged_offsets = module_storage.read_stage(os.path.join(base_path, offsets_filename))
+
+# conversion_status is consolidated keeping in mind the time window, as a threshold on conversion_offset
+print('{}\t\tConsolidating conversion_status with a window of {} days ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), window_days))
+df_bs_ct_merged_consolidated = module_label.apply_window(df_bs_ct_merged_offsets, window_days)
 
 out_filename = 'bs_ct_merged_consolidated_3m.csv'
-df_bs_ct_merged_consolidated.to_csv(os.path.join(base_path, out_filename), index=False)
+module_storage.write_stage(df_bs_ct_merged_consolidated, os.path.join(base_path, out_filename))
 
 df_bs_ct_merged_consolidated_info = df_info(df_bs_ct_merged_consolidated)
 print('\n{}\t"bs_ct_merged_consolidated" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
@@ -3,6 +3,7 @@ from pandarallel import pandarallel
 import pandas as pd
 import datetime
 import os
+import module_storage
 
 
 pandarallel.initialize(progress_bar=False, nb_workers=4)
@@ -22,8 +23,7 @@ def df_info(df):
 
 print('\n{}\tReading dataset: bs_ct_merged_consolidated_3m.csv ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 in_filename = '../data/sanitized/processed_base/bs_ct_merged_consolidated_3m.csv'
-df_base_data = pd.read_csv(os.path.join(base_path, in_filename))
-df_base_data.date = df_base_data.date.apply(lambda x: datetime.datetime.strptime(x, '%Y-%m-%d'))
+df_base_data = module_storage.read_stage(os.path.join(base_path, in_filename))
 df_base_data_info = df_info(df_base_data)
 print('\n{}\t"base_data" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_base_data.shape[0], df_base_data.shape[1], df_base_data_info[1]))
@@ -36,10 +36,10 @@ print(df_base_data.head().to_string())
 df_base_data_dev, df_base_data_ops = train_test_split(df_base_data, random_state=0, stratify=df_base_data.conversion_status)
 
 out_filename = 'base_data_dev_3m.csv'
-df_base_data_dev.to_csv(os.path.join(base_path, out_filename), index=False)
+module_storage.write_stage(df_base_data_dev, os.path.join(base_path, out_filename))
 
 out_filename = 'base_data_ops_3m.csv'
-df_base_data_ops.to_csv(os.path.join(base_path, out_filename), index=False)
+module_storage.write_stage(df_base_data_ops, os.path.join(base_path, out_filename), export_csv=True)
 
 df_base_data_dev_info = df_info(df_base_data_dev)
 print('\n{}\t"base_data_dev" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
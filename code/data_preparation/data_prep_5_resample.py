@@ -7,6 +7,7 @@ import os
 from collections import Counter
 import datetime
 from imblearn.under_sampling import TomekLinks
+import module_storage
 
 base_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -26,7 +27,7 @@ def df_info(df):
 # Reading the dataset base_data_dev_3m and printing it's basic summary
 print('\n{}\tReading base_data_dev_3m ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 in_filename = 'base_data_dev_3m.csv'
-df_final = pd.read_csv(os.path.join(base_path, in_filename))
+df_final = module_storage.read_stage(os.path.join(base_path, in_filename))
 df_final_info = df_info(df_final)
 print('\n{}\t"base_data_dev_3m" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 print('\t{} rows x {} columns | {:.2f} MB approx memory usage'.format(df_final.shape[0], df_final.shape[1], df_final_info[1]))
@@ -43,14 +44,14 @@ df_final_or = df_final[(df_final.count_user_stay <= 50) & (df_final.count_pay_at
                        & (df_final.nunique_dob <= 5) & (df_final.nunique_report_type <= 2)
                        & (df_final.nunique_language <= 2)]
 # Storing the outlier removed file into a csv
-df_final_or.to_csv('base_data_dev_3m_or.csv', encoding='utf-8', index=False)
+module_storage.write_stage(df_final_or, os.path.join(base_path, 'base_data_dev_3m_or.csv'))
 
 ###########################################################
 
 # Reading the dataset base_data_dev_3m_or and printing its basic summary
 print('\n{}\tReading data with outliers removed ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 in_filename = 'base_data_dev_3m_or.csv'
-df_final_or = pd.read_csv(os.path.join(base_path, in_filename))
+df_final_or = module_storage.read_stage(os.path.join(base_path, in_filename))
 print("Removing date column. To be appended later ...")
 df_final_or_info = df_info(df_final_or)
 print('\n{}\t"base_data_dev_3m_or" dataset summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
@@ -107,7 +108,7 @@ print("{}\tRandom undersampling done!".format(datetime.datetime.now().strftime('
 print("Separating Features and Labels for sampling ...")
 print("Temporarily converting dates to integer for Tomek sampling ...")
 # Preparing the date column for Tomek Sampling by converting it into integer
-final_resampled_1['date'] = final_resampled_1['date'].apply(lambda x: int(''.join(x.split('-'))))
+final_resampled_1['date'] = final_resampled_1['date'].dt.year * 10000 + final_resampled_1['date'].dt.month * 100 + final_resampled_1['date'].dt.day
 # Separating the features and targets
 X, y = final_resampled_1.drop('conversion_status', axis=1), final_resampled_1['conversion_status']
 print('\n{}Tomek Link resampling begins ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
@@ -120,9 +121,10 @@ X_t['conversion_status'] = y_t.values
 final_resampled_t1 = X_t.copy()
 print('\n{}Tomek Link resampling ends ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 
-# Reinstating the date column in the same format as a string
-final_resampled_t1['date'] = final_resampled_t1['date'].apply(lambda x: f"{str(x)[:4]}-{str(x)[4:6]}-{str(x)[6:]}")
-final_resampled_t1.to_csv('base_data_resampled_tomek.csv', encoding='utf-8', index=False)
+# Reinstating the date column as datetime64, from the yyyymmdd integers used for resampling
+final_resampled_t1['date'] = pd.to_datetime(final_resampled_t1['date'].astype(str), format='%Y%m%d')
+# The final dataset is also exported as csv for the model experiments and the web application
+module_storage.write_stage(final_resampled_t1, os.path.join(base_path, 'base_data_resampled_tomek.csv'), export_csv=True)
 print("Saving resampled_data_tomek.csv ...")
 
 # Printing the basic summary of the final undersampled dataset
@@ -0,0 +1,41 @@
+# This script ingests one new day of beacons, sessions and transactions into the feature store
+# It runs the processing stages 1 to 7 on that day only, instead of the whole data_prep chain
+
+import datetime
+import sys
+import os
+import module_feature_store
+import module_ingest
+
+base_path = os.path.dirname(os.path.realpath(__file__))
+
+######################
+
+# The day to ingest is supplied as an argument, as YYYY-MM-DD
+#   If not supplied, we shall ingest yesterday
+
+if len(sys.argv) >= 2:
+    day = datetime.datetime.strptime(sys.argv[1], '%Y-%m-%d').date()
+else:
+    day = datetime.date.today() - datetime.timedelta(days=1)
+day_suffix = datetime.datetime.strftime(day, '%Y%m%d')
+store_path = os.path.join(base_path, '../data/sanitized/feature_store')
+
+# Reading the raw data of the day, the sessions, customers and products are filtered
+#   in bounded chunks to the rows referenced by the day
+print('\n{}\tReading raw data of {} ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), day))
+df_b = module_ingest.read_table('b', os.path.join(base_path, '../data/sanitized/daily/b_' + day_suffix + '.csv'))
+df_s = module_ingest.read_table_filtered('s', os.path.join(base_path, '../data/sanitized/s.csv'), 'uuid', df_b.uuid.dropna().unique())
+df_ct = module_ingest.read_table('ct', os.path.join(base_path, '../data/sanitized/daily/ct_' + day_suffix + '.csv'))
+df_c = module_ingest.read_table_filtered('c', os.path.join(base_path, 'c.csv'), 'id', df_ct.cid.unique(), usecols=['id', 'email', 'profile_submit_count'])
+df_tp = module_ingest.read_table_filtered('tp', os.path.join(base_path, 'tp.csv'), 'ctid', df_ct.id.unique(), usecols=['ctid'])
+print('\t{} beacons | {} sessions | {} transactions'.format(df_b.shape[0], df_s.shape[0], df_ct.shape[0]))
+
+######################
+
+print('\n{}\tIngesting {} into the feature store ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), day))
+df_visits = module_feature_store.ingest_day(store_path, day, df_b, df_s, df_ct, df_c, df_tp)
+
+print('\n{}\t"visits" of {} summary:'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), day))
+print('\t{} rows x {} columns'.format(df_visits.shape[0], df_visits.shape[1]))
+print(df_visits.head().to_string())
@@ -0,0 +1,260 @@
+# This module holds the vectorized consolidation stages used by the data_prep scripts
+# Every consolidation computes all of its features from one grouped pass instead of
+# looking up and rescanning each group once per feature
+
+import numpy as np
+import pandas as pd
+import module_ingest
+
+
+def category_codes(series):
+    """
+    Function to encode a column as categorical codes so that nunique works on integers instead of Python objects
+    :param series: the column to encode, data type: Series
+    :return: array of codes with missing values as NaN, data type: numpy array
+    """
+    codes = series.astype('category').cat.codes.values.astype('float32')
+    codes[codes < 0] = float('nan')
+    return codes
+
+
+def consolidate_beacons(df_b):
+    """
+    Function to consolidate the beacons dataset by date and uuid in a single grouped pass
+    :param df_b: the beacons dataset with columns uuid, beacon_type, beacon_value and log_date, data type: DataFrame
+    :return: DataFrame with columns date, uuid, sum_beacon_value, nunique_beacon_type, count_user_stay,
+             count_pay_attempt and count_buy_click
+    """
+    # beacon_type has only a few dozen distinct values, so the string matching is done once per
+    # distinct value and broadcast to the rows through the categorical codes
+    beacon_type = df_b.beacon_type.astype('category')
+    beacon_code = beacon_type.cat.codes.values
+    categories = beacon_type.cat.categories.to_series()
+
+    df_flags = pd.DataFrame({'log_date': df_b.log_date.values,
+                             'uuid': df_b.uuid.values,
+                             'beacon_value': df_b.beacon_value.values,
+                             'beacon_code': beacon_code,
+                             'is_user_stay': (categories == 'user_stay').values.astype('int32')[beacon_code],
+                             'is_pay_attempt': categories.str.contains('pay').values.astype('int32')[beacon_code],
+                             'is_buy_click': categories.str.contains('buy|bottom').values.astype('int32')[beacon_code]})
+
+    df_b_cb_date_uuid = df_flags.groupby(['log_date', 'uuid'], sort=True).agg(
+        sum_beacon_value=('beacon_value', 'sum'),
+        nunique_beacon_type=('beacon_code', 'nunique'),
+        count_user_stay=('is_user_stay', 'sum'),
+        count_pay_attempt=('is_pay_attempt', 'sum'),
+        count_buy_click=('is_buy_click', 'sum'))
+
+    df_b_cb_date_uuid = df_b_cb_date_uuid.reset_index().rename(columns={'log_date': 'date'})
+    return df_b_cb_date_uuid
+
+
+def partial_consolidate_beacons(df_b_chunk):
+    """
+    Function to partially consolidate one chunk of the beacons dataset by date and uuid
+    :param df_b_chunk: a chunk of the beacons dataset with clean column types, data type: DataFrame
+    :return: tuple of two DataFrames indexed by (log_date, uuid): the additive counts of the chunk and
+             a 0/1 presence matrix with one column per beacon_type seen in the chunk
+    """
+    beacon_type = df_b_chunk.beacon_type.astype('category')
+    beacon_code = beacon_type.cat.codes.values
+    categories = beacon_type.cat.categories.to_series()
+
+    df_flags = pd.DataFrame({'log_date': df_b_chunk.log_date.values,
+                             'uuid': df_b_chunk.uuid.values,
+                             'sum_beacon_value': df_b_chunk.beacon_value.values,
+                             'count_user_stay': (categories == 'user_stay').values.astype('int32')[beacon_code],
+                             'count_pay_attempt': categories.str.contains('pay').values.astype('int32')[beacon_code],
+                             'count_buy_click': categories.str.contains('buy|bottom').values.astype('int32')[beacon_code]})
+    df_counts = df_flags.groupby(['log_date', 'uuid']).sum()
+
+    # The set of beacon types of each group is kept as a presence matrix so that partial sets can be
+    #   merged with a vectorized max instead of Python set unions
+    df_flags['beacon_type'] = beacon_type.values
+    df_seen = df_flags.groupby(['log_date', 'uuid', 'beacon_type'], observed=True).size().unstack(fill_value=0)
+    df_seen = df_seen.clip(upper=1).astype('uint8')
+    df_seen.columns = df_seen.columns.astype(str)
+    return df_counts, df_seen
+
+
+def combine_partial_beacons(counts_list, seen_list):
+    """
+    Function to merge partial beacon consolidations, sums and counts are added and the presence matrices are OR-ed
+    :param counts_list: the additive counts of each partial consolidation, data type: list of DataFrames
+    :param seen_list: the beacon_type presence matrices of each partial consolidation, data type: list of DataFrames
+    :return: tuple of the merged counts and the merged presence matrix
+    """
+    df_counts = pd.concat(counts_list).groupby(level=['log_date', 'uuid']).sum()
+    df_seen = pd.concat(seen_list).fillna(0).astype('uint8').groupby(level=['log_date', 'uuid']).max()
+    return df_counts, df_seen
+
+
+def stream_consolidate_beacons(filepath, chunksize=1000000, compact_every=8):
+    """
+    Function to consolidate the raw beacons file by date and uuid while reading it in bounded chunks
+    :param filepath: path of the raw beacons csv file, data type: str
+    :param chunksize: number of raw rows read per chunk, data type: int
+    :param compact_every: number of partial consolidations buffered before they are merged, data type: int
+    :return: DataFrame with the same columns as consolidate_beacons
+    """
+    counts_list, seen_list = [], []
+    for df_b_chunk in module_ingest.read_table('b', filepath, chunksize=chunksize):
+        # Applying processing stage 1 to the chunk
+        df_b_chunk = df_b_chunk.dropna()
+        df_b_chunk.uuid = df_b_chunk.uuid.astype('int64')
+        df_b_chunk.beacon_value = df_b_chunk.beacon_value.astype('int64')
+
+        df_counts, df_seen = partial_consolidate_beacons(df_b_chunk)
+        counts_list.append(df_counts)
+        seen_list.append(df_seen)
+        if len(counts_list) >= compact_every:
+            df_counts, df_seen = combine_partial_beacons(counts_list, seen_list)
+            counts_list, seen_list = [df_counts], [df_seen]
+
+    df_counts, df_seen = combine_partial_beacons(counts_list, seen_list)
+    df_counts.insert(1, 'nunique_beacon_type', df_seen.sum(axis=1).reindex(df_counts.index).astype('int64'))
+
+    df_b_cb_date_uuid = df_counts.sort_index().reset_index().rename(columns={'log_date': 'date'})
+    return df_b_cb_date_uuid
+
+
+def consolidate_sessions(df_bs_merged):
+    """
+    Function to roll up the merged beacons and sessions dataset by date and email in a single grouped pass
+    :param df_bs_merged: the merged dataset from processing stage 3, data type: DataFrame
+    :return: DataFrame with columns date, email, count_sessions, the summed beacon features and the
+             nunique_gender, nunique_dob, nunique_language, nunique_report_type and nunique_device columns
+    """
+    df_codes = pd.DataFrame({'date': df_bs_merged.date.values,
+                             'email': df_bs_merged.email.values,
+                             'sum_beacon_value': df_bs_merged.sum_beacon_value.values,
+                             'nunique_beacon_type': df_bs_merged.nunique_beacon_type.values,
+                             'count_user_stay': df_bs_merged.count_user_stay.values,
+                             'count_pay_attempt': df_bs_merged.count_pay_attempt.values,
+                             'count_buy_click': df_bs_merged.count_buy_click.values,
+                             'gender': category_codes(df_bs_merged.gender),
+                             'dob': category_codes(df_bs_merged.dob),
+                             'language': category_codes(df_bs_merged.language),
+                             'report_type': category_codes(df_bs_merged.report_type),
+                             'device': category_codes(df_bs_merged.device)})
+
+    df_bs_merged_cb_date_email = df_codes.groupby(['date', 'email'], sort=True).agg(
+        count_sessions=('sum_beacon_value', 'size'),
+        sum_beacon_value=('sum_beacon_value', 'sum'),
+        nunique_beacon_type=('nunique_beacon_type', 'sum'),
+        count_user_stay=('count_user_stay', 'sum'),
+        count_pay_attempt=('count_pay_attempt', 'sum'),
+        count_buy_click=('count_buy_click', 'sum'),
+        nunique_gender=('gender', 'nunique'),
+        nunique_dob=('dob', 'nunique'),
+        nunique_language=('language', 'nunique'),
+        nunique_report_type=('report_type', 'nunique'),
+        nunique_device=('device', 'nunique'))
+
+    return df_bs_merged_cb_date_email.reset_index()
+
+
+# The raw transaction statuses that mean the customer converted, matched on the lowercase status
+CONVERTED_STATUS_PREFIXES = ('purchase', 'converted', 'y', 'processed', 'payment_completed', 'initiated',
+                             'pdf_error', 'toprocess', 'delivered')
+
+
+def conversion_flags(status):
+    """
+    Function to map each raw transaction status to a 0/1 conversion flag
+    :param status: the raw status column, data type: Series
+    :return: the conversion flag of each row, data type: numpy array of int8
+    """
+    # There are only a handful of distinct statuses, each of them is mapped once
+    status = status.astype('category')
+    category_flags = [int(str(category).lower().startswith(CONVERTED_STATUS_PREFIXES)) for category in status.cat.categories]
+    # The trailing 0 is the flag of the missing statuses, whose code is -1
+    return np.array(category_flags + [0], dtype='int8')[status.cat.codes.values]
+
+
+def consolidate_conversions(df_ct_merged):
+    """
+    Function to consolidate the merged transactions dataset by date and email in a single grouped pass
+    :param df_ct_merged: the merged dataset from processing stage 5, data type: DataFrame
+    :return: DataFrame with columns date, email, conversion_status ('Y' or 'N'), profile_submit_count
+             and transactions_amount
+    """
+    df_flags = pd.DataFrame({'date': df_ct_merged.timestamp.values,
+                             'email': df_ct_merged.email.values,
+                             'conversion_flag': conversion_flags(df_ct_merged.status),
+                             'profile_submit_count': df_ct_merged.profile_submit_count.values,
+                             'amount': df_ct_merged.amount.values})
+
+    df_ct_merged_cb_date_email = df_flags.groupby(['date', 'email'], sort=True).agg(
+        conversion_flag=('conversion_flag', 'max'),
+        profile_submit_count=('profile_submit_count', 'first'),
+        transactions_amount=('amount', 'sum')).reset_index()
+
+    df_ct_merged_cb_date_email.conversion_flag = np.where(df_ct_merged_cb_date_email.conversion_flag.values == 1, 'Y', 'N')
+    return df_ct_merged_cb_date_email.rename(columns={'conversion_flag': 'conversion_status'})
+
+
+def join_customers(df_ct, df_c):
+    """
+    Function to join the transactions with the email and profile_submit_count of their customers
+    :param df_ct: the transactions dataset, data type: DataFrame
+    :param df_c: the customers dataset, data type: DataFrame
+    :return: DataFrame with columns id, cid, timestamp, amount, status, email and profile_submit_count
+    """
+    # Joining on the sorted unique customer id index
+    df_c_by_id = df_c[['id', 'email', 'profile_submit_count']].set_index('id').sort_index()
+    return df_ct[['id', 'cid', 'timestamp', 'amount', 'status']].join(df_c_by_id, on='cid', how='inner')
+
+
+def repeat_products(df_ct_joined, ctid_count):
+    """
+    Function to repeat the joined transactions once per row of their products
+    :param df_ct_joined: the transactions joined with their customers, data type: DataFrame
+    :param ctid_count: number of rows of the products dataset per ctid, i.e. df_tp.ctid.value_counts(), data type: Series
+    :return: DataFrame with columns cid, timestamp, amount, status, email, profile_submit_count and ctid
+    """
+    # The products dataset only filters and repeats the transactions, so it is joined
+    #   through its number of rows per ctid instead of its columns
+    multiplicity = df_ct_joined.id.map(ctid_count).fillna(0).astype('int64').values
+    df_ct_merged = df_ct_joined.iloc[np.repeat(np.arange(len(df_ct_joined)), multiplicity)]
+    return df_ct_merged.rename(columns={'id': 'ctid'})[['cid', 'timestamp', 'amount', 'status', 'email', 'profile_submit_count', 'ctid']].reset_index(drop=True)
+
+
+def merge_transactions(df_ct, df_c, ctid_count):
+    """
+    Function to merge the transactions with their customers and products, projecting only the needed columns
+    :param df_ct: the transactions dataset, data type: DataFrame
+    :param df_c: the customers dataset, data type: DataFrame
+    :param ctid_count: number of rows of the products dataset per ctid, i.e. df_tp.ctid.value_counts(), data type: Series
+    :return: DataFrame with columns cid, timestamp, amount, status, email, profile_submit_count and ctid
+    """
+    return repeat_products(join_customers(df_ct, df_c), ctid_count)
+
+
+def consolidate_transactions_partitioned(df_ct, df_c, df_tp, n_partitions):
+    """
+    Function to merge and consolidate the transactions by date and email one partition of emails at a time
+    :param df_ct: the transactions dataset, data type: DataFrame
+    :param df_c: the customers dataset, data type: DataFrame
+    :param df_tp: the products dataset, data type: DataFrame
+    :param n_partitions: number of partitions, by hash of email, data type: int
+    :return: DataFrame with the same columns as consolidate_conversions
+    """
+    # Several customer ids may share an email, so the transactions are partitioned on the email
+    #   of their customer: the (date, email) groups never span two partitions, and only the
+    #   partition repeated by its products is held in memory at a time
+    df_ct_joined = join_customers(df_ct.dropna(subset=['cid']), df_c.dropna(subset=['id']))
+    # The rows without email belong to no (date, email) group
+    df_ct_joined = df_ct_joined[df_ct_joined.email.notna().values]
+    ct_partition = df_ct_joined.email.values.astype('int64') % n_partitions
+
+    ctid_count = df_tp.ctid.value_counts()
+    partial_list = []
+    for partition in range(n_partitions):
+        df_ct_merged = repeat_products(df_ct_joined[ct_partition == partition], ctid_count)
+        partial_list.append(consolidate_conversions(df_ct_merged))
+        del df_ct_merged
+    return pd.concat(partial_list).sort_values(['date', 'email']).reset_index(drop=True)
+
+###############################################################################
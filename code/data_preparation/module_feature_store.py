@@ -0,0 +1,150 @@
+# This module is the incremental feature store of the base dataset, keyed by (date, email)
+# Each ingested day computes only the visits of that day and appends them as a date partition,
+# the conversion labels are stored as offsets and only the trailing window partitions are updated
+
+import os
+import datetime
+import pandas as pd
+import module_consolidate
+import module_label
+import module_storage
+
+# Number of trailing days whose conversion offsets are updated by a new day,
+#   it is the longest conversion window that can be materialized from the store
+MAX_WINDOW_DAYS = 14
+
+
+def partition_path(store_path, day):
+    """
+    Function to get the path of the visits partition of a day
+    :param store_path: root directory of the feature store, data type: str
+    :param day: the day of the partition, data type: datetime.date object
+    :return: path of the partition, data type: str
+    """
+    return os.path.join(store_path, 'visits', 'visits_' + datetime.datetime.strftime(day, '%Y%m%d') + '.csv')
+
+
+def partition_exists(store_path, day):
+    return os.path.isfile(module_storage.stage_path(partition_path(store_path, day)))
+
+
+def customers_path(store_path, day):
+    """
+    Function to get the path of the running customer totals after a day was ingested
+    :param store_path: root directory of the feature store, data type: str
+    :param day: the last day folded into the totals, data type: datetime.date object
+    :return: path of the customer totals, data type: str
+    """
+    return os.path.join(store_path, 'customers', 'customers_' + datetime.datetime.strftime(day, '%Y%m%d') + '.csv')
+
+
+def last_ingested_day(store_path):
+    """
+    Function to get the last day completely ingested into the feature store
+    :param store_path: root directory of the feature store, data type: str
+    :return: datetime.date object, or None if no day was ingested
+    """
+    # The customer totals are written last by ingest_day, their file marks the day as complete
+    dirname_customers = os.path.join(store_path, 'customers')
+    if not os.path.isdir(dirname_customers):
+        return None
+    days = [datetime.datetime.strptime(filename[len('customers_'):len('customers_') + 8], '%Y%m%d').date()
+            for filename in os.listdir(dirname_customers) if filename.startswith('customers_')]
+    return max(days) if days else None
+
+
+def ingest_day(store_path, day, df_b, df_s, df_ct, df_c, df_tp):
+    """
+    Function to compute the visits of one day and append them to the feature store
+    :param store_path: root directory of the feature store, data type: str
+    :param day: the day to ingest, it must follow the last day ingested, data type: datetime.date object
+    :param df_b: the raw beacons of the day, data type: DataFrame
+    :param df_s: the raw sessions of the uuids of the day, data type: DataFrame
+    :param df_ct: the raw transactions of the day, data type: DataFrame
+    :param df_c: the raw customers of the transactions of the day, data type: DataFrame
+    :param df_tp: the raw products of the transactions of the day, data type: DataFrame
+    :return: DataFrame of the visits of the day
+    """
+    # A day before the last one would only be labelled against its own conversions, not the ones of the later days
+    last_day = last_ingested_day(store_path)
+    if last_day is not None and day == last_day:
+        raise ValueError('{} is already in the feature store'.format(day))
+    if last_day is not None and day < last_day:
+        raise ValueError('{} is before the last day in the feature store, {}, the days must be ingested in order'.format(day, last_day))
+    os.makedirs(os.path.join(store_path, 'visits'), exist_ok=True)
+    os.makedirs(os.path.join(store_path, 'customers'), exist_ok=True)
+
+    # Processing stages 1 to 4 on the beacons and sessions of the day
+    df_b = df_b.dropna()
+    df_b.uuid = df_b.uuid.astype('int64')
+    df_b.beacon_value = df_b.beacon_value.astype('int64')
+    df_s = df_s.dropna().drop(columns=['status', 'log_date'])
+    df_s.uuid = df_s.uuid.astype('int64')
+    df_s.email = df_s.email.astype('int64')
+    df_bs_merged = module_consolidate.consolidate_beacons(df_b).merge(df_s, on='uuid', how='inner')
+    df_visits = module_consolidate.consolidate_sessions(df_bs_merged)
+
+    # Processing stages 5 & 6 on the transactions of the day
+    df_ct_merged = module_consolidate.merge_transactions(df_ct, df_c, df_tp.ctid.value_counts())
+    df_conversions = module_consolidate.consolidate_conversions(df_ct_merged)
+
+    # The customer features are running totals over all the transactions ingested so far,
+    #   they are computed from the totals of the last day, so that a failed day can be ingested again
+    df_customer = df_conversions[['email', 'profile_submit_count', 'transactions_amount']]
+    if last_day is not None:
+        df_customer = pd.concat([module_storage.read_stage(customers_path(store_path, last_day)), df_customer])
+    df_customer = df_customer.groupby('email', sort=False).agg(
+        profile_submit_count=('profile_submit_count', 'first'),
+        transactions_amount=('transactions_amount', 'sum')).reset_index()
+
+    # Processing stage 7 on the visits of the day, against the conversions of the day
+    df_customer_by_email = df_customer.set_index('email')
+    df_visits['conversion_offset'] = module_label.conversion_offsets(df_visits, df_conversions)
+    df_visits['profile_submit_count'] = df_visits.email.map(df_customer_by_email.profile_submit_count).fillna(0).astype('int64')
+    df_visits['transactions_amount'] = df_visits.email.map(df_customer_by_email.transactions_amount).fillna(-1.0)
+    module_storage.write_stage(df_visits, partition_path(store_path, day))
+    # The schema of the partitions, as a file without rows, for the ranges without partition
+    module_storage.write_stage(df_visits.iloc[0:0], os.path.join(store_path, 'visits_schema.csv'))
+
+    # A conversion of the day is the next conversion of the trailing visits that had none yet
+    converted_emails = df_conversions.email[df_conversions.conversion_status.str.startswith('Y')].values
+    for days_ago in range(1, MAX_WINDOW_DAYS):
+        past_day = day - datetime.timedelta(days=days_ago)
+        if not partition_exists(store_path, past_day):
+            continue
+        df_past_visits = module_storage.read_stage(partition_path(store_path, past_day))
+        is_updated = (df_past_visits.conversion_offset.values == -1) & df_past_visits.email.isin(converted_emails).values
+        if is_updated.any():
+            df_past_visits.loc[is_updated, 'conversion_offset'] = days_ago
+            module_storage.write_stage(df_past_visits, partition_path(store_path, past_day))
+
+    # Writing the customer totals last marks the day as complete, the updates above are
+    #   written again with the same values if the day is ingested again after a failure
+    module_storage.write_stage(df_customer, customers_path(store_path, day))
+    if last_day is not None:
+        os.remove(module_storage.stage_path(customers_path(store_path, last_day)))
+
+    return df_visits
+
+
+def read_store(store_path, start_day, end_day, window_days=3):
+    """
+    Function to read the labelled visits of a range of days from the feature store
+    :param store_path: root directory of the feature store, data type: str
+    :param start_day: first day of the range, data type: datetime.date object
+    :param end_day: last day of the range, data type: datetime.date object
+    :param window_days: length of the conversion window, at most MAX_WINDOW_DAYS, data type: int
+    :return: DataFrame with the columns of the base dataset
+    """
+    if window_days > MAX_WINDOW_DAYS:
+        raise ValueError('window_days must be at most {}, got {}'.format(MAX_WINDOW_DAYS, window_days))
+    day_list = [ts.date() for ts in pd.date_range(start_day, end_day, freq='D')]
+    visits_list = [module_storage.read_stage(partition_path(store_path, day)) for day in day_list if partition_exists(store_path, day)]
+    if not visits_list:
+        schema_path = os.path.join(store_path, 'visits_schema.csv')
+        if not os.path.isfile(module_storage.stage_path(schema_path)):
+            raise ValueError('the feature store {} is empty'.format(store_path))
+        visits_list = [module_storage.read_stage(schema_path)]
+    return module_label.apply_window(pd.concat(visits_list, ignore_index=True), window_days)
+
+###############################################################################
@@ -0,0 +1,72 @@
+# This module declares the schemas of the raw tables and reads them with the column types
+# applied by the csv parser, instead of converting the columns row by row after reading
+
+import pandas as pd
+
+# All the date columns of the raw tables are parsed with this fixed format,
+#   the time part of the session timestamps is not used by the pipeline
+DATE_FORMAT = '%Y-%m-%d'
+
+# ids are read as nullable integers and the low cardinality strings as categoricals
+SCHEMAS = {
+    'b': {'dtype': {'uuid': 'Int64', 'beacon_type': 'category', 'beacon_value': 'Int64', 'log_date': str},
+          'dates': ['log_date']},
+    's': {'dtype': {'uuid': 'Int64', 'phone': 'Int64', 'status': 'Int64', 'gender': 'category', 'dob': 'category',
+                    'language': 'category', 'email': 'Int64', 'report_type': 'category', 'device': 'category',
+                    'log_date': str},
+          'dates': ['log_date']},
+    'c': {'dtype': {'id': 'Int64', 'email': 'Int64', 'primary_phone': 'Int64', 'secondary_phones': str,
+                    'profile_submit_count': 'Int64'},
+          'dates': []},
+    'ct': {'dtype': {'id': 'Int64', 'cid': 'Int64', 'timestamp': str, 'amount': 'float64', 'status': 'category'},
+           'dates': ['timestamp']},
+    'tp': {'dtype': {'ctid': 'Int64', 'variant': 'category', 'language': 'category', 'status': 'category'},
+           'dates': []}
+}
+
+
+def parse_dates(df, date_columns):
+    """
+    Function to parse the date columns of a table with the fixed DATE_FORMAT
+    :param df: the table read from csv, data type: DataFrame
+    :param date_columns: the date columns declared in the schema of the table, data type: list
+    :return: the same DataFrame with datetime64 date columns
+    """
+    for col in date_columns:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col].str.slice(0, 10), format=DATE_FORMAT)
+    return df
+
+
+def read_table(table_name, filepath, usecols=None, chunksize=None):
+    """
+    Function to read one of the raw tables with its declared schema
+    :param table_name: the name of the raw table, one of SCHEMAS keys, data type: str
+    :param filepath: path of the csv file, data type: str
+    :param usecols: the columns to read, all of them if None, data type: list
+    :param chunksize: if given, the table is read in chunks of that many rows, data type: int
+    :return: DataFrame, or a generator of DataFrames if chunksize is given
+    """
+    schema = SCHEMAS[table_name]
+    dtype = {col: col_type for col, col_type in schema['dtype'].items() if usecols is None or col in usecols}
+    reader = pd.read_csv(filepath, dtype=dtype, usecols=usecols, chunksize=chunksize)
+    if chunksize is None:
+        return parse_dates(reader, schema['dates'])
+    return (parse_dates(df_chunk, schema['dates']) for df_chunk in reader)
+
+
+def read_table_filtered(table_name, filepath, column, values, usecols=None, chunksize=1000000):
+    """
+    Function to read only the rows of a raw table whose column is in a set of values, in bounded chunks
+    :param table_name: the name of the raw table, one of SCHEMAS keys, data type: str
+    :param filepath: path of the csv file, data type: str
+    :param column: the column to filter on, data type: str
+    :param values: the values to keep, data type: array-like
+    :param usecols: the columns to read, all of them if None, data type: list
+    :param chunksize: number of rows read per chunk, data type: int
+    :return: DataFrame
+    """
+    chunk_list = [df_chunk[df_chunk[column].isin(values)] for df_chunk in read_table(table_name, filepath, usecols, chunksize)]
+    return pd.concat(chunk_list, ignore_index=True)
+
+###############################################################################
@@ -0,0 +1,91 @@
+# This module labels the visits of the base dataset with the conversion events of the customers
+# The visits and the conversion events are joined through sorted (email, day) keys, so that all
+# the visits are labelled in one vectorized pass instead of one group lookup per visit
+# The join stores, for each visit, the number of days to the next conversion of the customer,
+# so that any conversion window can be materialized afterwards without joining again
+
+import numpy as np
+
+
+def day_numbers(dates):
+    """
+    Function to convert dates to day numbers
+    :param dates: the dates to convert, data type: Series or array of datetime64
+    :return: number of days since 1970-01-01, data type: numpy array of int64
+    """
+    return np.asarray(dates, dtype='datetime64[D]').astype('int64')
+
+
+def conversion_offsets(df_visits, df_conversions):
+    """
+    Function to get the number of days from each visit to the next conversion of its customer
+    :param df_visits: the visits consolidated by date and email, data type: DataFrame
+    :param df_conversions: the conversion events consolidated by date and email, data type: DataFrame
+    :return: offset in days of the first 'Y' event on or after the visit date, -1 if there is none,
+             data type: numpy array of int32
+    """
+    is_converted = df_conversions.conversion_status.str.startswith('Y').values
+    event_email = df_conversions.email.values[is_converted].astype('int64')
+    event_day = day_numbers(df_conversions.date.values[is_converted])
+    visit_email = df_visits.email.values.astype('int64')
+    visit_day = day_numbers(df_visits.date.values)
+
+    # Encoding (email, day) into a single key, the keys of a customer never overlap the next customer
+    all_days = np.concatenate([visit_day, event_day])
+    first_day = all_days.min()
+    span = all_days.max() - first_day + 1
+    event_key = np.sort(event_email * span + (event_day - first_day))
+    visit_key = visit_email * span + (visit_day - first_day)
+
+    # The first event key on or after the visit key is the next conversion if it is of the same customer
+    next_event = np.searchsorted(event_key, visit_key, side='left')
+    next_event_key = np.append(event_key, np.iinfo('int64').max)[next_event]
+    has_next = next_event_key // span == visit_email
+    return np.where(has_next, next_event_key - visit_key, -1).astype('int32')
+
+
+def add_conversion_offsets(df_visits, df_conversions):
+    """
+    Function to join the visits with the conversion events of their customers
+    :param df_visits: the visits consolidated by date and email, data type: DataFrame
+    :param df_conversions: the conversion events consolidated by date and email, data type: DataFrame
+    :return: copy of df_visits with the conversion_offset, profile_submit_count and transactions_amount columns
+    """
+    # The customer features are taken from all the conversion events of the customer
+    df_customer = df_conversions.groupby('email', sort=False).agg(
+        profile_submit_count=('profile_submit_count', 'first'),
+        transactions_amount=('transactions_amount', 'sum'))
+
+    df_offsets = df_visits.copy()
+    df_offsets['conversion_offset'] = conversion_offsets(df_visits, df_conversions)
+    df_offsets['profile_submit_count'] = df_offsets.email.map(df_customer.profile_submit_count).fillna(0).astype('int64')
+    df_offsets['transactions_amount'] = df_offsets.email.map(df_customer.transactions_amount).fillna(-1.0)
+    return df_offsets
+
+
+def apply_window(df_offsets, window_days=3):
+    """
+    Function to materialize the conversion_status of the visits for a conversion window
+    :param df_offsets: the visits joined by add_conversion_offsets, data type: DataFrame
+    :param window_days: length of the conversion window starting the day of the visit, data type: int
+    :return: copy of df_offsets with conversion_status in place of conversion_offset
+    """
+    if window_days < 1:
+        raise ValueError('window_days must be at least 1, got {}'.format(window_days))
+    offset = df_offsets.conversion_offset.values
+    df_labelled = df_offsets.copy()
+    df_labelled['conversion_offset'] = ((offset >= 0) & (offset < window_days)).astype('int64')
+    return df_labelled.rename(columns={'conversion_offset': 'conversion_status'})
+
+
+def label_visits(df_visits, df_conversions, window_days=3):
+    """
+    Function to label each visit with the conversion events of its customer
+    :param df_visits: the visits consolidated by date and email, data type: DataFrame
+    :param df_conversions: the conversion events consolidated by date and email, data type: DataFrame
+    :param window_days: length of the conversion window starting the day of the visit, data type: int
+    :return: copy of df_visits with the conversion_status, profile_submit_count and transactions_amount columns
+    """
+    return apply_window(add_conversion_offsets(df_visits, df_conversions), window_days)
+
+###############################################################################
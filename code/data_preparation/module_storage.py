@@ -0,0 +1,86 @@
+# This module is the storage backend used to hand off the datasets between the data_prep stages
+# The stages are stored in a typed columnar format so that the next stage neither re-parses text
+# nor re-converts dates, csv is kept as a backend and as an export option
+
+import os
+import pandas as pd
+
+# The backend used by all the stages, one of 'parquet', 'feather' or 'csv'
+STORAGE_FORMAT = 'parquet'
+
+
+def write_parquet(df, filepath):
+    df.to_parquet(filepath, index=False)
+
+
+def read_parquet(filepath, columns=None):
+    # Only the requested columns are read from the file
+    return pd.read_parquet(filepath, columns=columns)
+
+
+def write_feather(df, filepath):
+    df.reset_index(drop=True).to_feather(filepath)
+
+
+def read_feather(filepath, columns=None):
+    # The file is memory mapped instead of being read into a buffer first
+    from pyarrow import feather
+    return feather.read_table(filepath, columns=columns, memory_map=True).to_pandas()
+
+
+def write_csv(df, filepath):
+    df.to_csv(filepath, index=False)
+
+
+def read_csv(filepath, columns=None):
+    df = pd.read_csv(filepath, usecols=columns)
+    # Parsing the date column so that every backend returns the same column types
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d')
+    return df
+
+
+BACKENDS = {'parquet': ('.parquet', write_parquet, read_parquet),
+            'feather': ('.feather', write_feather, read_feather),
+            'csv': ('.csv', write_csv, read_csv)}
+
+
+def stage_path(filepath, storage_format=None):
+    """
+    Function to get the path of a stage file for a storage format
+    :param filepath: path of the stage file, its extension is replaced by the one of the format, data type: str
+    :param storage_format: one of BACKENDS keys, STORAGE_FORMAT if None, data type: str
+    :return: path of the stage file, data type: str
+    """
+    extension = BACKENDS[storage_format or STORAGE_FORMAT][0]
+    return os.path.splitext(filepath)[0] + extension
+
+
+def write_stage(df, filepath, storage_format=None, export_csv=False):
+    """
+    Function to store the output dataset of a stage
+    :param df: the dataset to store, data type: DataFrame
+    :param filepath: path of the stage file, data type: str
+    :param storage_format: one of BACKENDS keys, STORAGE_FORMAT if None, data type: str
+    :param export_csv: if True, a csv copy is also written next to the stage file, data type: bool
+    :return: None
+    """
+    storage_format = storage_format or STORAGE_FORMAT
+    BACKENDS[storage_format][1](df, stage_path(filepath, storage_format))
+    if export_csv and storage_format != 'csv':
+        write_csv(df, stage_path(filepath, 'csv'))
+    return None
+
+
+def read_stage(filepath, columns=None, storage_format=None):
+    """
+    Function to read the output dataset of a previous stage
+    :param filepath: path of the stage file, data type: str
+    :param columns: the columns to read, all of them if None, data type: list
+    :param storage_format: one of BACKENDS keys, STORAGE_FORMAT if None, data type: str
+    :return: DataFrame
+    """
+    storage_format = storage_format or STORAGE_FORMAT
+    return BACKENDS[storage_format][2](stage_path(filepath, storage_format), columns)
+
+###############################################################################
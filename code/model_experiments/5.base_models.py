@@ -9,6 +9,7 @@ import os
 import datetime
 from sklearn.linear_model import SGDClassifier as SDC
 from sklearn.preprocessing import StandardScaler 
+from sklearn.pipeline import Pipeline
 import joblib
 
 # Reading the dataset base_data_resampled_tomek.csv
@@ -35,32 +36,30 @@ feature_set_4 = ['sum_beacon_value', 'count_pay_attempt', 'count_buy_click',
 feature_set_5 = ['count_pay_attempt', 'count_buy_click',
                  'nunique_report_type', 'profile_submit_count']
 
-print("Standard scaling the Data ...")
-scaler = StandardScaler()
-X_scaled_s_f1 = scaler.fit_transform(X[feature_set_1])
-X_scaled_s_f4 = scaler.fit_transform(X[feature_set_4])
-X_scaled_s_f5 = scaler.fit_transform(X[feature_set_5])
-
 print("Creating the SDC model with tuned hyperparameters ...")
 
+def base_model_pipeline(final_base_model):
+    """
+    Each model is dumped together with the standard scaler fitted on the training set,
+    so that the deployed modules apply the same scaling at prediction time
+    """
+    return Pipeline([('scaler', StandardScaler()), ('model', final_base_model)])
+
 final_base_model_t2 = SDC(random_state=23, max_iter=3000, loss='log', alpha=0.00001, penalty='elasticnet')
 final_base_model_t3 = SDC(random_state=23, max_iter=3000, loss='log', alpha=0.01, class_weight='balanced', penalty='l2')
 
 
-# Fitting and dumping the 3 models
+# Standard scaling the data, fitting and dumping the 3 models
 
 print("Dumping 1 ...")
-final_base_model_t2.fit(X_scaled_s_f1, y)
-joblib.dump(final_base_model_t2, 'SDC_f1_s_jlib.pkl')
+joblib.dump(base_model_pipeline(final_base_model_t2).fit(X[feature_set_1], y), 'SDC_f1_s_jlib.pkl')
 
 print("Dumping 2 ...")
-final_base_model_t2.fit(X_scaled_s_f4, y)
-joblib.dump(final_base_model_t2, 'SDC_f4_s_jlib.pkl')
+joblib.dump(base_model_pipeline(final_base_model_t2).fit(X[feature_set_4], y), 'SDC_f4_s_jlib.pkl')
 
 
 print("Dumping 3 ...")
-final_base_model_t3.fit(X_scaled_s_f5, y)
-joblib.dump(final_base_model_t3, 'SDC_f5_s_t3_jlib.pkl')
+joblib.dump(base_model_pipeline(final_base_model_t3).fit(X[feature_set_5], y), 'SDC_f5_s_t3_jlib.pkl')
 
 print("Model dumped ...")
 
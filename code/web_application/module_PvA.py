@@ -4,55 +4,230 @@ import datetime
 import os
 import numpy as np
 import pandas as pd
-from sklearn.metrics import recall_score as rc
-from sklearn.metrics import balanced_accuracy_score as bac
+import module_predict
 
 
-def evaluate_report(data_stream, prediction_date):
+def evaluate_report(data_stream, prediction_date, df_predicted=None):
     """
     Function to get the prediction report of a specific date.
     :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
     :param prediction_date: the date for which the prediction report was generated, data type: datetime.date object
+    :param df_predicted: the prediction report of the date, taken from the report cache or its csv file if None, data type: DataFrame
     :return: DataFrame consisting of the PvA report
     """
-    base_path = os.path.dirname(os.path.realpath(__file__))
-    
-    filename_prediction_report = 'prediction_report_' + datetime.datetime.strftime(prediction_date, '%Y%m%d') + '.csv' 
+    if df_predicted is None:
+        df_predicted = load_report(prediction_date)
     # If the report for the day is not generated return this message
-    if not os.path.isfile(filename_prediction_report):
+    if df_predicted is None:
         return "Prediction report for the selected date doesn't exist."
-    
-    # Getting the actual and predicted data
+
+    # Getting the actual data and its email index
     df_actuals = data_stream.get_data(prediction_date)
-    df_predicted = pd.read_csv(os.path.join(base_path, filename_prediction_report))
-    
-    # Merging the actual and predicted files on email
-    df_actuals_predicted = pd.merge(df_actuals, df_predicted, on='email', how='inner')
-    
-    # Creating a DataFrame to store the PvA report
-    df_display = pd.DataFrame()
-
-    # Converting the probabilities into binary choices based on the threshold 1,0
-    df_display['conversion_status_predicted'] = pd.Series(np.where(df_actuals_predicted['conversion_probability']>=0.5, 1, 0), dtype=np.int)
-    y_pred = df_display['conversion_status_predicted'].to_numpy()
-
-    # Extracting actual conversion_status from the merged model
-    y_true = df_actuals_predicted['conversion_status'].to_numpy()
-    # Storing the extracted y's into the new DataFrame that we created
-    df_display['conversion_status_actual'] = pd.Series(y_true)
-
-    # Creating a confusion matrix for actual v/s predicted
-    df_confusion = pd.crosstab(y_true, y_pred, rownames=['Actual'], colnames=['Predicted'], margins=True)
-    
-    # Calculating the Balanced Accuracy and Recall Scores
-    bac_score = bac(y_true, y_pred)
-    rc_score = rc(y_true, y_pred)
-    
-    # Calculating the conversion_rate
-    conversion_predicted = df_display['conversion_status_actual'].sum()
-    conversion_actual = df_display['conversion_status_predicted'].sum()
-    conversion_rate = (conversion_actual/conversion_predicted)*100
-    
+    return evaluate_predictions(df_actuals, df_predicted, data_stream.get_email_index(prediction_date))
+
+
+def load_report(prediction_date):
+    """
+    Function to get the prediction report last served for a date
+    :param prediction_date: the date for which the prediction report was generated, data type: datetime.date object
+    :return: DataFrame of the report, or None if it was not generated
+    """
+    base_path = os.path.dirname(os.path.realpath(__file__))
+
+    # The report last served for the day is taken from memory, the csv file is only read by the other workers
+    df_predicted = module_predict.report_cache.last_report(prediction_date)
+    if df_predicted is None:
+        filename_prediction_report = module_predict.report_filename(prediction_date)
+        if not os.path.isfile(filename_prediction_report):
+            return None
+        df_predicted = pd.read_csv(os.path.join(base_path, filename_prediction_report))
+    return df_predicted
+
+
+def evaluate_reports(data_stream, prediction_reports):
+    """
+    Function to evaluate in-memory prediction reports of several dates, e.g. the reports of module_predict.predict_range
+    :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
+    :param prediction_reports: dict of datetime.date object -> prediction report of that date, data type: dict
+    :return: dict of datetime.date object -> PvA report of that date
+    """
+    return {prediction_date: evaluate_report(data_stream, prediction_date, df_predicted) for prediction_date, df_predicted in prediction_reports.items()}
+
+
+def match_report(df_actuals, df_predicted, email_index=None):
+    """
+    Function to join a prediction report to the actual conversion_status of its day
+    :param df_actuals: the visits of the day with their conversion_status, data type: DataFrame
+    :param df_predicted: the prediction report of the day, data type: DataFrame
+    :param email_index: the index of the emails of df_actuals, built if None, data type: pandas Index
+    :return: tuple of the actual conversion_status and the conversion_probability of the matched rows, data type: numpy arrays
+    """
+    if email_index is None:
+        email_index = pd.Index(df_actuals['email'].to_numpy())
+
+    # Joining the predicted emails to their rows in the actuals, the emails not visiting that day are left out
+    positions = email_index.get_indexer(df_predicted['email'].to_numpy())
+    is_matched = positions >= 0
+    y_true = df_actuals['conversion_status'].to_numpy()[positions[is_matched]].astype(np.int64)
+    probabilities = df_predicted['conversion_probability'].to_numpy()[is_matched]
+    return y_true, probabilities
+
+
+def threshold_counts(y_true, probabilities, thresholds):
+    """
+    Function to count the confusion matrix of the predictions at several thresholds, with a single sort
+    :param y_true: the actual conversion_status, data type: numpy array of 0/1
+    :param probabilities: the conversion_probability, data type: numpy array
+    :param thresholds: the thresholds from which a probability is a predicted conversion, data type: numpy array
+    :return: numpy array of the tn, fp, fn and tp counts, one row per threshold
+    """
+    order = np.argsort(probabilities, kind='mergesort')
+    sorted_probabilities = probabilities[order]
+    # Number of actual conversions below each position of the sorted probabilities
+    positives_below = np.r_[0, np.cumsum(y_true[order])]
+
+    # The rows predicted as conversions at a threshold are the ones from its insertion position on
+    n_below = np.searchsorted(sorted_probabilities, thresholds, side='left')
+    n_positives = positives_below[-1]
+    fn = positives_below[n_below]
+    tn = n_below - fn
+    tp = n_positives - fn
+    fp = (len(probabilities) - n_below) - tp
+    return np.stack([tn, fp, fn, tp], axis=1).astype(np.int64)
+
+
+def counts_metrics(counts, thresholds):
+    """
+    Function to derive the metrics from the confusion matrices of several thresholds
+    :param counts: the tn, fp, fn and tp counts, one row per threshold, data type: numpy array
+    :param thresholds: the thresholds of the rows of counts, data type: numpy array
+    :return: DataFrame of the counts, REC, BAC, precision and conversion% per threshold
+    """
+    df_metrics = pd.DataFrame(counts, columns=['tn', 'fp', 'fn', 'tp'], index=pd.Index(thresholds, name='threshold'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = df_metrics.tp / (df_metrics.tp + df_metrics.fn)
+        specificity = df_metrics.tn / (df_metrics.tn + df_metrics.fp)
+        df_metrics['REC'] = recall.fillna(0.0)
+        # The balanced accuracy averages the recall of the classes present in the actuals
+        df_metrics['BAC'] = pd.concat([recall, specificity], axis=1).mean(axis=1)
+        df_metrics['precision'] = df_metrics.tp / (df_metrics.tp + df_metrics.fp)
+        df_metrics['conversion%'] = (df_metrics.tp + df_metrics.fp) / (df_metrics.tp + df_metrics.fn) * 100
+    return df_metrics
+
+
+def threshold_sweep(y_true, probabilities):
+    """
+    Function to compute the metrics at every threshold, each distinct probability, with a single sort
+    :param y_true: the actual conversion_status, data type: numpy array of 0/1
+    :param probabilities: the conversion_probability, data type: numpy array
+    :return: DataFrame of the counts, BAC, REC, precision and conversion% per threshold, from the highest threshold
+    """
+    thresholds = np.unique(probabilities)[::-1]
+    df_sweep = counts_metrics(threshold_counts(y_true, probabilities, thresholds), thresholds)
+    # The number of customers predicted as conversions, to choose the threshold by capacity
+    df_sweep.insert(0, 'n_predicted', df_sweep.tp + df_sweep.fp)
+    return df_sweep
+
+
+def sweep_reports(data_stream, prediction_reports):
+    """
+    Function to compute the threshold curve of the prediction reports of a day or a range of days, pooled together
+    :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
+    :param prediction_reports: dict of datetime.date object -> prediction report of that date, the report last
+        served for the date is used if it is None, data type: dict
+    :return: DataFrame of the counts, BAC, REC, precision and conversion% per threshold, or a message if no report exists
+    """
+    y_true_list, probabilities_list = [], []
+    for prediction_date, df_predicted in prediction_reports.items():
+        if df_predicted is None:
+            df_predicted = load_report(prediction_date)
+        if df_predicted is None:
+            continue
+        y_true, probabilities = match_report(data_stream.get_data(prediction_date), df_predicted, data_stream.get_email_index(prediction_date))
+        y_true_list.append(y_true)
+        probabilities_list.append(probabilities)
+    if not y_true_list:
+        return "Prediction report for the selected dates doesn't exist."
+    return threshold_sweep(np.concatenate(y_true_list), np.concatenate(probabilities_list))
+
+
+class MetricsAccumulator:
+    """
+    Confusion matrices of the evaluated days at several thresholds, updated day by day, from which the
+    metrics of any range of days are derived without evaluating the prediction reports again
+    """
+
+    def __init__(self, thresholds=(0.5,)):
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        # date -> tn, fp, fn, tp counts per threshold
+        self.day_counts = {}
+        # date -> number of conversions and of customers in the report
+        self.day_report_hits = {}
+
+    def update(self, prediction_date, df_actuals, df_predicted, email_index=None):
+        """
+        Function to add the evaluation of a day, replacing the previous one of the same day
+        :param prediction_date: the date of the prediction report, data type: datetime.date object
+        :param df_actuals: the visits of the day with their conversion_status, data type: DataFrame
+        :param df_predicted: the prediction report of the day, data type: DataFrame
+        :param email_index: the index of the emails of df_actuals, built if None, data type: pandas Index
+        :return: None
+        """
+        y_true, probabilities = match_report(df_actuals, df_predicted, email_index)
+        self.day_counts[prediction_date] = threshold_counts(y_true, probabilities, self.thresholds)
+        self.day_report_hits[prediction_date] = (int(y_true.sum()), len(df_predicted))
+        return None
+
+    def metrics(self, start_date=None, end_date=None):
+        """
+        Function to get the metrics of the days evaluated in a range
+        :param start_date: first date of the range, from the first evaluated day if None, data type: datetime.date object
+        :param end_date: last date of the range, up to the last evaluated day if None, data type: datetime.date object
+        :return: DataFrame of the counts, BAC, REC, precision, precision@k and conversion% per threshold
+        """
+        days = [day for day in self.day_counts if (start_date is None or day >= start_date) and (end_date is None or day <= end_date)]
+        counts = sum((self.day_counts[day] for day in days), np.zeros((len(self.thresholds), 4), dtype=np.int64))
+        report_conversions = sum(self.day_report_hits[day][0] for day in days)
+        report_customers = sum(self.day_report_hits[day][1] for day in days)
+
+        df_metrics = counts_metrics(counts, self.thresholds)
+        df_metrics['precision@k'] = report_conversions / report_customers if report_customers else np.nan
+        return df_metrics
+
+    def rolling(self, end_date, days=7):
+        """
+        Function to get the metrics of the days evaluated in a trailing window
+        :param end_date: last date of the window, data type: datetime.date object
+        :param days: length of the window, e.g. 7 or 30, data type: int
+        :return: DataFrame of the counts, BAC, REC, precision@k and conversion% per threshold
+        """
+        return self.metrics(end_date - datetime.timedelta(days=days - 1), end_date)
+
+
+def evaluate_predictions(df_actuals, df_predicted, email_index=None):
+    """
+    Function to compare a prediction report with the actual conversion_status of its day
+    :param df_actuals: the visits of the day with their conversion_status, data type: DataFrame
+    :param df_predicted: the prediction report of the day, data type: DataFrame
+    :param email_index: the index of the emails of df_actuals, built if None, data type: pandas Index
+    :return: tuple of the recall, balanced accuracy, predicted and actual conversions and conversion rate
+    """
+    y_true, probabilities = match_report(df_actuals, df_predicted, email_index)
+
+    # Counting the confusion matrix of the binary choices based on the threshold 0.5
+    thresholds = np.array([0.5])
+    counts = threshold_counts(y_true, probabilities, thresholds)
+
+    # Calculating the Balanced Accuracy, Recall Scores and conversion_rate from the confusion matrix
+    df_metrics = counts_metrics(counts, thresholds)
+    rc_score = df_metrics.REC.iloc[0]
+    bac_score = df_metrics.BAC.iloc[0]
+    conversion_rate = df_metrics['conversion%'].iloc[0]
+
+    tn, fp, fn, tp = counts[0]
+    conversion_predicted = tp + fn
+    conversion_actual = tp + fp
+
     return rc_score, bac_score, conversion_actual, conversion_predicted, conversion_rate
 
 ###################################################################################
@@ -0,0 +1,102 @@
+# This script backtests model candidates over a range of days, replaying the web application:
+#   each day is predicted, evaluated against its actuals, and then the model is inc. trained on
+#   the visits of 3 days before
+# The inc. training is chronological, so the models of the days are built in order first, then the
+#   days are scored and evaluated in parallel by a pool of processes sharing the loaded base data
+
+import copy
+import datetime
+import multiprocessing
+import sys
+import joblib
+import pandas as pd
+import module_dep
+import module_inc_train
+import module_predict
+import module_PvA
+
+# Loaded before the pool is created, the forked workers share its pages copy-on-write
+data_stream = None
+
+
+def model_snapshots(model, prediction_dates):
+    """
+    Function to replay the inc. training over the prediction dates, in chronological order
+    :param model: the ml model the backtest starts from, it is not modified, data type: Pipeline
+    :param prediction_dates: the dates to predict, data type: list of datetime.date objects
+    :return: list of tuples of each date with a copy of the model used to predict it
+    """
+    model = copy.deepcopy(model)
+    trained_days = set()
+    snapshots = []
+    for prediction_date in sorted(set(prediction_dates)):
+        snapshots.append((prediction_date, copy.deepcopy(model)))
+        # After the report of the date, the model is trained on the visits of 3 days before, once per day
+        day = module_inc_train.training_day(prediction_date)
+        df_inc_train = data_stream.get_data(day)
+        if day not in trained_days and df_inc_train.shape[0] > 0:
+            module_inc_train.partial_fit_day(model, df_inc_train)
+            trained_days.add(day)
+    return snapshots
+
+
+def backtest_day(job):
+    """
+    Function run by the workers, predicting and evaluating one date with its model
+    :param job: tuple of the name of the candidate, the date and the model to predict it with, data type: tuple
+    :return: dict of the metrics of the date
+    """
+    filename_model, prediction_date, model = job
+    df_actuals = data_stream.get_data(prediction_date)
+    df_predicted = module_predict.score_report(model, df_actuals)
+    rc_score, bac_score, conversion_actual, conversion_predicted, conversion_rate = module_PvA.evaluate_predictions(df_actuals, df_predicted)
+    return {'model': filename_model, 'date': prediction_date, 'BAC': bac_score, 'REC': rc_score, 'conversion%': conversion_rate}
+
+
+def run_backtest(data_stream_loaded, filenames_model, prediction_dates, n_processes=None):
+    """
+    Function to backtest model candidates over the prediction dates
+    :param data_stream_loaded: the object that lets us retrieve the input data, it is loaded before the workers are forked, data type: module_dep.Datastream object
+    :param filenames_model: the model files of the candidates, data type: list of str
+    :param prediction_dates: the dates to predict, data type: list of datetime.date objects
+    :param n_processes: number of worker processes, all the cpus if None, data type: int
+    :return: tuple of the DataFrame of the metrics per candidate and date, and the DataFrame of their mean and variance per candidate
+    """
+    global data_stream
+    data_stream = data_stream_loaded
+
+    # Days without visits have no report to evaluate
+    prediction_dates = [prediction_date for prediction_date in prediction_dates if data_stream.get_data(prediction_date).shape[0] > 0]
+    jobs = []
+    for filename_model in filenames_model:
+        print('{}\tReplaying the inc. training of {} ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), filename_model))
+        jobs += [(filename_model, prediction_date, model) for prediction_date, model in model_snapshots(joblib.load(filename_model), prediction_dates)]
+
+    print('{}\tScoring {} days ...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), len(jobs)))
+    with multiprocessing.get_context('fork').Pool(n_processes) as pool:
+        df_eval = pd.DataFrame(pool.map(backtest_day, jobs))
+
+    # Population variance over the days, as np.var in Misc/unit_test.py
+    df_summary = df_eval.groupby('model', sort=False)[['BAC', 'REC', 'conversion%']].agg(['mean', ('var', lambda s: s.var(ddof=0))])
+    return df_eval, df_summary
+
+
+if __name__ == '__main__':
+    # The days to backtest are supplied as arguments YYYY-MM-DD YYYY-MM-DD, followed by the model files
+    #   If not supplied, we shall backtest SDC_f1_s_jlib.pkl over the last 7 days of the base data
+    base_data_stream = module_dep.DataStream()
+    base_data_stream.initialize_data()
+
+    if len(sys.argv) >= 3:
+        start_date = datetime.datetime.strptime(sys.argv[1], '%Y-%m-%d').date()
+        end_date = datetime.datetime.strptime(sys.argv[2], '%Y-%m-%d').date()
+    else:
+        end_date = max(base_data_stream.date_index)
+        start_date = end_date - datetime.timedelta(days=6)
+    filenames_model = sys.argv[3:] if len(sys.argv) >= 4 else ['SDC_f1_s_jlib.pkl']
+
+    df_eval, df_summary = run_backtest(base_data_stream, filenames_model, module_dep.date_list(start_date, end_date))
+    print(df_eval.to_string())
+    print(df_summary.to_string())
+
+###############################################################################
@@ -1,27 +1,255 @@
 import pandas as pd
+import numpy as np
 import datetime
+import time
+import os
+import threading
+from collections import OrderedDict
+
+def date_ranges(dates):
+    """
+    Function to map each date of a sorted date column to its contiguous range of rows
+    :param dates: the sorted dates, data type: numpy array of datetime64
+    :return: dict of datetime.date object -> slice of rows
+    """
+    starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]]) if len(dates) else np.array([], dtype=int)
+    stops = np.r_[starts[1:], len(dates)]
+    # Only the distinct dates are converted to datetime.date objects, as keys of the index
+    return {pd.Timestamp(dates[start]).date(): slice(start, stop) for start, stop in zip(starts, stops)}
+
+
+def date_list(start_date, end_date):
+    return [start_date + datetime.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
 
 class DataStream:
-    
+
     df_base_data = None
-    
+    date_index = None
+    email_indexes = None
+    load_time = None
+
+    filename_base_data = 'base_data_resampled_tomek_ops.csv'
+    filename_snapshot = 'base_data_resampled_tomek_ops.feather'
+
+    def initialize_data(self):
+        """
+        Function to read the source (base) data, type convert date column and index the rows by date
+        The data is read from the binary snapshot if it is up to date with the csv file
+        :return: None
+        """
+        start_time = time.perf_counter()
+        if os.path.isfile(self.filename_snapshot) and os.path.getmtime(self.filename_snapshot) >= os.path.getmtime(self.filename_base_data):
+            source = self.filename_snapshot
+            self.df_base_data = pd.read_feather(self.filename_snapshot)
+        else:
+            source = self.filename_base_data
+            self.df_base_data = pd.read_csv(self.filename_base_data)
+            # Parsing all the dates at once instead of one strptime call per row
+            self.df_base_data.date = pd.to_datetime(self.df_base_data.date, format='%Y-%m-%d')
+        self.build_date_index()
+        self.load_time = time.perf_counter() - start_time
+        print('{}\tLoaded {} rows from {} in {:.3f} s'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), self.df_base_data.shape[0], source, self.load_time))
+        return None
+
+    def save_snapshot(self):
+        """
+        Function to write the loaded base data to the binary snapshot read by initialize_data
+        :return: None
+        """
+        self.df_base_data.to_feather(self.filename_snapshot)
+        return None
+
+    def save_partitions(self, dirname_partitions='base_data_partitions'):
+        """
+        Function to write the loaded base data to one binary file per date, read by LazyDataStream
+        :param dirname_partitions: the directory of the partitions, data type: str
+        :return: None
+        """
+        os.makedirs(dirname_partitions, exist_ok=True)
+        for filter_date in self.date_index:
+            self.get_data(filter_date).reset_index(drop=True).to_feather(os.path.join(dirname_partitions, partition_filename(filter_date)))
+        # The schema of the partitions, as a file without rows, gives the dates without partition their columns
+        self.df_base_data.iloc[0:0].reset_index(drop=True).to_feather(os.path.join(dirname_partitions, 'schema.feather'))
+        return None
+
+    def save_shared(self, dirname_shared='base_data_shared'):
+        """
+        Function to publish the columns of the loaded base data as .npy files, memory mapped by SharedDataStream
+        :param dirname_shared: the directory of the published columns, data type: str
+        :return: None
+        """
+        os.makedirs(dirname_shared, exist_ok=True)
+        for col in self.df_base_data.columns:
+            np.save(os.path.join(dirname_shared, col + '.npy'), self.df_base_data[col].to_numpy())
+        with open(os.path.join(dirname_shared, 'columns.txt'), 'w') as f:
+            f.write('\n'.join(self.df_base_data.columns))
+        return None
+
+    def check_up_to_date(self, filename_built):
+        """
+        Function to check that a file built from the base data is not older than the csv file
+        :param filename_built: the file written last when the base data was published, data type: str
+        :return: None
+        """
+        if os.path.isfile(self.filename_base_data) and os.path.getmtime(filename_built) < os.path.getmtime(self.filename_base_data):
+            raise RuntimeError('{} is older than {}, publish the base data again by running module_dep.py'.format(filename_built, self.filename_base_data))
+        return None
+
+    def build_date_index(self):
+        """
+        Function to sort the base data by date and map each date to its contiguous range of rows
+        :return: None
+        """
+        # A stable sort keeps the original order of the rows within a date
+        self.df_base_data = self.df_base_data.sort_values(by='date', kind='mergesort').reset_index(drop=True)
+        self.date_index = date_ranges(self.df_base_data.date.values)
+        return None
+
+    def get_data(self, filter_date):
+        """
+        :param filter_date: the date for which the data is requested, data type: datetime.date object
+        :return: sliced dataframe, a view on the rows of that date
+        """
+        df_filtered_data = self.df_base_data.iloc[self.date_index.get(filter_date, slice(0, 0))]
+        return df_filtered_data
+
+    def get_email_index(self, filter_date):
+        """
+        :param filter_date: the date for which the email index is requested, data type: datetime.date object
+        :return: index of the emails of the rows of that date, built on the first request, data type: pandas Index
+        """
+        if self.email_indexes is None:
+            self.email_indexes = {}
+        if filter_date not in self.email_indexes:
+            self.email_indexes[filter_date] = pd.Index(self.get_data(filter_date).email.to_numpy())
+        return self.email_indexes[filter_date]
+
+    def get_range(self, start_date, end_date):
+        """
+        :param start_date: first date of the range, data type: datetime.date object
+        :param end_date: last date of the range, data type: datetime.date object
+        :return: sliced dataframe sorted by date, a view on the rows of the dates of the range
+        """
+        # The rows are sorted by date, so the dates of the range are one contiguous range of rows
+        row_ranges = [self.date_index[filter_date] for filter_date in date_list(start_date, end_date) if filter_date in self.date_index]
+        if not row_ranges:
+            return self.get_data(start_date)
+        df_filtered_data = self.df_base_data.iloc[row_ranges[0].start:row_ranges[-1].stop]
+        return df_filtered_data
+
+
+def partition_filename(filter_date):
+    return 'base_data_' + datetime.datetime.strftime(filter_date, '%Y%m%d') + '.feather'
+
+
+class LazyDataStream(DataStream):
+    """
+    DataStream backend that keeps the base data on disk partitioned by date and only loads the
+    requested dates, keeping the most recently used ones in memory
+    """
+
+    dirname_partitions = 'base_data_partitions'
+    max_cached_dates = 14
+    df_schema = None
+
+    def initialize_data(self):
+        """
+        Function to prepare the cache of dates, only the schema of the partitions is read until a date is requested
+        :return: None
+        """
+        # The schema is written after the partitions, the partitions are stale if it is older than the csv file
+        filename_schema = os.path.join(self.dirname_partitions, 'schema.feather')
+        self.check_up_to_date(filename_schema)
+        self.df_schema = pd.read_feather(filename_schema)
+        self.date_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        return None
+
+    def get_data(self, filter_date):
+        """
+        :param filter_date: the date for which the data is requested, data type: datetime.date object
+        :return: dataframe of the rows of that date
+        """
+        with self.cache_lock:
+            if filter_date in self.date_cache:
+                self.date_cache.move_to_end(filter_date)
+                return self.date_cache[filter_date]
+
+        filename_partition = os.path.join(self.dirname_partitions, partition_filename(filter_date))
+        # The dates without partition are not cached, so that they don't evict the hot dates
+        if not os.path.isfile(filename_partition):
+            return self.df_schema.copy()
+        df_filtered_data = pd.read_feather(filename_partition)
+
+        with self.cache_lock:
+            self.date_cache[filter_date] = df_filtered_data
+            # Evicting the least recently used dates
+            while len(self.date_cache) > self.max_cached_dates:
+                self.date_cache.popitem(last=False)
+        return df_filtered_data
+
+    def get_range(self, start_date, end_date):
+        """
+        :param start_date: first date of the range, data type: datetime.date object
+        :param end_date: last date of the range, data type: datetime.date object
+        :return: dataframe of the rows of the dates of the range, sorted by date
+        """
+        df_filtered_data = pd.concat([self.get_data(filter_date) for filter_date in date_list(start_date, end_date)], ignore_index=True)
+        return df_filtered_data
+
+
+class SharedDataStream(DataStream):
+    """
+    DataStream backend that maps the columns published by DataStream.save_shared read-only, so that
+    every worker process shares the same pages of the base data instead of holding a private copy
+    """
+
+    dirname_shared = 'base_data_shared'
+    shared_columns = None
+
     def initialize_data(self):
         """
-        Function to read the source (base) data and type convert date column
+        Function to attach zero-copy views of the published columns and index their rows by date
         :return: None
         """
-        filename_base_data = 'base_data_resampled_tomek_ops.csv'
-        self.df_base_data = pd.read_csv(filename_base_data)
-        self.df_base_data.date = self.df_base_data.date.apply(lambda x: datetime.datetime.strptime(x, '%Y-%m-%d').date())
+        # The column list is written after the columns, the columns are stale if it is older than the csv file
+        filename_columns = os.path.join(self.dirname_shared, 'columns.txt')
+        self.check_up_to_date(filename_columns)
+        with open(filename_columns) as f:
+            columns = f.read().split('\n')
+        self.shared_columns = {col: np.load(os.path.join(self.dirname_shared, col + '.npy'), mmap_mode='r') for col in columns}
+        # The published columns are already sorted by date
+        self.date_index = date_ranges(self.shared_columns['date'])
         return None
 
     def get_data(self, filter_date):
         """
         :param filter_date: the date for which the data is requested, data type: datetime.date object
-        :return: sliced dataframe
+        :return: dataframe of the rows of that date, only these rows are copied out of the shared columns
+        """
+        rows = self.date_index.get(filter_date, slice(0, 0))
+        df_filtered_data = pd.DataFrame({col: np.array(values[rows]) for col, values in self.shared_columns.items()})
+        return df_filtered_data
+
+    def get_range(self, start_date, end_date):
+        """
+        :param start_date: first date of the range, data type: datetime.date object
+        :param end_date: last date of the range, data type: datetime.date object
+        :return: dataframe of the rows of the dates of the range, only these rows are copied out of the shared columns
         """
-        df_filtered_data = self.df_base_data.loc[self.df_base_data.date==filter_date]
+        row_ranges = [self.date_index[filter_date] for filter_date in date_list(start_date, end_date) if filter_date in self.date_index]
+        rows = slice(row_ranges[0].start, row_ranges[-1].stop) if row_ranges else slice(0, 0)
+        df_filtered_data = pd.DataFrame({col: np.array(values[rows]) for col, values in self.shared_columns.items()})
         return df_filtered_data
-    
-    
+
+
+if __name__ == '__main__':
+    # Building the binary snapshot, the date partitions and the shared columns of the base data
+    data_stream = DataStream()
+    data_stream.initialize_data()
+    data_stream.save_snapshot()
+    data_stream.save_partitions()
+    data_stream.save_shared()
+
 ###############################################################################
\ No newline at end of file
@@ -1,38 +1,241 @@
+import copy
 import datetime
-from sklearn.preprocessing import StandardScaler
-import joblib
+import fcntl
+import os
+import queue
+import sys
+import threading
+import module_dep
+import module_model
+
+# Number of days after which the conversion status of a visit is known, the model
+#   is trained on the visits of that many days before the prediction date
+label_delay_days = 3
+
+feature_set_1 = ['transactions_amount', 'count_pay_attempt', 'nunique_beacon_type',
+                 'count_user_stay', 'count_buy_click', 'profile_submit_count',
+                 'sum_beacon_value']
+# feature_set_5 = ['count_pay_attempt', 'count_buy_click',
+#                  'nunique_report_type', 'profile_submit_count']
+
+
+class TrainingLock:
+    """
+    Lock held on a lock file next to the model, so that only one training of all the threads and worker
+    processes reads, updates and saves the model at a time and no update is lost
+    """
+
+    def __init__(self, filename_lock):
+        self.filename_lock = filename_lock
+        # flock only excludes the other processes, the threads of a process are excluded by this lock
+        self.thread_lock = threading.Lock()
+        self.lock_file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        self.lock_file = open(self.filename_lock, 'a')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
+        self.thread_lock.release()
+        return False
+
+
+training_lock = TrainingLock(module_model.model_registry.filename_model + '.lock')
+
+
+class TrainingLedger:
+    """
+    Persisted list of the days whose visits were already folded into the model, one YYYY-MM-DD per line,
+    so that each day is partial fitted only once across reloads and restarts
+    The header line holds the version of the model file the days were saved with, if the model file was
+    replaced since, e.g. rebuilt by 5.base_models.py, the days of the ledger are not in the new model
+    """
+
+    def __init__(self, filename_ledger, model_registry):
+        self.filename_ledger = filename_ledger
+        self.model_registry = model_registry
+        self.lock = threading.Lock()
+
+    def trained_days(self):
+        """
+        Function to read the days already folded into the current model file
+        :return: set of datetime.date objects, empty if the ledger belongs to another model file
+        """
+        with self.lock:
+            if not os.path.isfile(self.filename_ledger):
+                return set()
+            with open(self.filename_ledger) as f:
+                lines = f.read().split('\n')
+        if lines[0] != self.model_header():
+            return set()
+        return {datetime.datetime.strptime(line, '%Y-%m-%d').date() for line in lines[1:] if line}
+
+    def save_days(self, days):
+        """
+        Function to record the days folded into the model file just saved, the ledger file is replaced in one step
+        :param days: all the days trained, data type: set of datetime.date objects
+        :return: None
+        """
+        with self.lock:
+            filename_tmp = '{}.{}.tmp'.format(self.filename_ledger, os.getpid())
+            with open(filename_tmp, 'w') as f:
+                f.write('\n'.join([self.model_header()] + [datetime.datetime.strftime(day, '%Y-%m-%d') for day in sorted(days)]))
+            os.replace(filename_tmp, self.filename_ledger)
+        return None
+
+    def model_header(self):
+        return '# model {} {}'.format(*self.model_registry.file_version())
+
+
+def training_day(prediction_date):
+    return prediction_date - datetime.timedelta(days=label_delay_days)
+
+
+def partial_fit_day(model, df_inc_train):
+    """
+    Function to partial fit the model in place on the visits of one day
+    :param model: the ml model, data type: Pipeline
+    :param df_inc_train: the visits of the day with their conversion_status, data type: DataFrame
+    :return: None
+    """
+    # Seperating the features and labels
+    X = df_inc_train.drop(columns=['email', 'date', 'conversion_status'])
+    y = df_inc_train['conversion_status']
+
+    # Scaling the X with the scaler fitted at training time
+    classifier, X_scaled = module_model.scale_features(model, X[module_model.model_features(model, feature_set_1)])
+    classifier.partial_fit(X_scaled, y)
+    return None
+
+
+def fit_days(data_stream, days):
+    """
+    Function to partial fit a copy of the model on the visits of each day not in the ledger, in order,
+    and swap in the updated model once
+    :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
+    :param days: the days to train the model on, data type: list of datetime.date objects
+    :return: list of the days trained, data type: list of datetime.date objects
+    """
+    with training_lock:
+        trained_days = training_ledger.trained_days()
+        model = None
+        days_fitted = []
+        for day in sorted(set(days) - trained_days):
+            df_inc_train = data_stream.get_data(day)
+            # Days without visits are left out of the ledger, their data may still come
+            if df_inc_train.shape[0] == 0:
+                continue
+
+            # Partial fitting a copy of the cached model, so that predictions keep using the current one until it is swapped,
+            #   get_model reloads the model file if another worker saved it since it was cached
+            if model is None:
+                model = copy.deepcopy(module_model.model_registry.get_model())
+            partial_fit_day(model, df_inc_train)
+            days_fitted.append(day)
+
+        # Updating the model file, then the ledger with the version of the new model file
+        if days_fitted:
+            module_model.model_registry.save_model(model)
+            training_ledger.save_days(trained_days | set(days_fitted))
+    return days_fitted
+
 
 def inc_train(data_stream, prediction_date):
     """
-    Function to inc. train the ml model on data from prediction_date - 3 days
+    Function to inc. train the ml model on data from prediction_date - 3 days, if it was not trained on it yet
     :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
     :param prediction_date: the date for which the prediction report was generated, data type: datetime.date object
     :return: None
     """
-    
-    # getting the date from three days ago to train the model
-    three_days_ago = prediction_date - datetime.timedelta(days=3)
-    df_inc_train = data_stream.get_data(three_days_ago)
-    
-    # Seperating the features and labels 
-    X = df_inc_train.drop(columns=['email', 'date', 'conversion_status'])
-    y = df_inc_train['conversion_status']
-    
-    # Fixing the feature set chosen
-    feature_set_1 = ['transactions_amount', 'count_pay_attempt', 'nunique_beacon_type',
-                     'count_user_stay', 'count_buy_click', 'profile_submit_count',
-                     'sum_beacon_value']
-    # feature_set_5 = ['count_pay_attempt', 'count_buy_click',
-    #                  'nunique_report_type', 'profile_submit_count']
-    
-    # Scaling the X
-    X_scaled = StandardScaler().fit_transform(X[feature_set_1])
-    
-    model_chosen = 'SDC_f1_s_jlib.pkl'
-    model = joblib.load(model_chosen)
-    # Partial fitting to the model data from 3 days ago and updating model_chosen
-    model.partial_fit(X_scaled, y)
-    joblib.dump(model, model_chosen)
+    fit_days(data_stream, [training_day(prediction_date)])
     return None
 
+
+def catch_up(data_stream, start_date, end_date):
+    """
+    Function to inc. train the ml model on all the days of a range that are missing from the ledger
+    :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
+    :param start_date: first day of the range, data type: datetime.date object
+    :param end_date: last day of the range, data type: datetime.date object
+    :return: list of the days trained, data type: list of datetime.date objects
+    """
+    return fit_days(data_stream, module_dep.date_list(start_date, end_date))
+
+
+training_ledger = TrainingLedger('SDC_f1_s_jlib_ledger.txt', module_model.model_registry)
+
+
+class TrainingQueue:
+    """
+    Queue of the incremental training jobs, run one at a time by a background thread so that
+    the requests only wait for the prediction
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.pending_dates = set()
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def submit(self, data_stream, prediction_date):
+        """
+        Function to queue the incremental training of a date, a date already queued or trained is skipped
+        :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
+        :param prediction_date: the date for which the prediction report was generated, data type: datetime.date object
+        :return: True if the date was queued, data type: bool
+        """
+        with self.lock:
+            if prediction_date in self.pending_dates or training_day(prediction_date) in training_ledger.trained_days():
+                return False
+            self.pending_dates.add(prediction_date)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+        self.jobs.put((data_stream, prediction_date))
+        return True
+
+    def run(self):
+        """
+        Function run by the background thread, training the model on the queued dates in order
+        :return: None
+        """
+        while True:
+            data_stream, prediction_date = self.jobs.get()
+            try:
+                print('{}\tIncremental training for {} begins...'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), prediction_date))
+                inc_train(data_stream, prediction_date)
+            except Exception as e:
+                print('{}\tIncremental training for {} failed: {}'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), prediction_date, e))
+            finally:
+                with self.lock:
+                    self.pending_dates.discard(prediction_date)
+                self.jobs.task_done()
+
+    def join(self):
+        """
+        Function to wait until all the queued dates are trained
+        :return: None
+        """
+        self.jobs.join()
+        return None
+
+
+training_queue = TrainingQueue()
+
+
+if __name__ == '__main__':
+    # Catching up on all the days of a range missing from the ledger, the range is supplied as
+    #   arguments YYYY-MM-DD YYYY-MM-DD
+    data_stream = module_dep.DataStream()
+    data_stream.initialize_data()
+    start_date = datetime.datetime.strptime(sys.argv[1], '%Y-%m-%d').date()
+    end_date = datetime.datetime.strptime(sys.argv[2], '%Y-%m-%d').date()
+    days_fitted = catch_up(data_stream, start_date, end_date)
+    print('{}\tTrained the model on {} days: {}'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), len(days_fitted), ', '.join(str(day) for day in days_fitted)))
+
 #################################################################################
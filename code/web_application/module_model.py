@@ -0,0 +1,95 @@
+# This module keeps the ml model loaded in memory for the other modules
+# The model is only deserialized again when its file changes on disk
+
+import datetime
+import os
+import threading
+import joblib
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+
+class ModelRegistry:
+
+    def __init__(self, filename_model):
+        self.filename_model = filename_model
+        self.model = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def file_version(self):
+        """
+        Function to get the version of the model file
+        :return: tuple of the modification time in ns and the size of the file
+        """
+        file_stat = os.stat(self.filename_model)
+        return file_stat.st_mtime_ns, file_stat.st_size
+
+    def get_model(self):
+        """
+        Function to get the model, reloading it only if the file changed since it was loaded
+        :return: the ml model
+        """
+        with self.lock:
+            version = self.file_version()
+            if self.model is None or version != self.version:
+                self.model = joblib.load(self.filename_model)
+                self.version = version
+            return self.model
+
+    def save_model(self, model):
+        """
+        Function to dump an updated model to the file and swap it in as the in-memory model
+        :param model: the updated ml model, it must not be the object returned by get_model
+        :return: None
+        """
+        with self.lock:
+            # Dumping to a temporary file that replaces the model file in one step, so that
+            #   other workers never load a partially written model
+            filename_tmp = '{}.{}.tmp'.format(self.filename_model, os.getpid())
+            joblib.dump(model, filename_tmp)
+            os.replace(filename_tmp, self.filename_model)
+            self.model = model
+            self.version = self.file_version()
+        return None
+
+
+def model_features(model, default_features):
+    """
+    Function to get the features a model was fitted on, so that candidates of any feature set can be used
+    :param model: the ml model, a Pipeline of the fitted scaler and the classifier, data type: Pipeline
+    :param default_features: the features of the models dumped without their feature names, data type: list
+    :return: list of the features of the model
+    """
+    if isinstance(model, Pipeline) and hasattr(model[:-1], 'feature_names_in_'):
+        return list(model[:-1].feature_names_in_)
+    if hasattr(model, 'feature_names_in_'):
+        return list(model.feature_names_in_)
+    return default_features
+
+
+def scale_features(model, X):
+    """
+    Function to scale the features with the scaler stored in the model pipeline
+    :param model: the ml model, a Pipeline of the fitted scaler and the classifier, data type: Pipeline
+    :param X: the features of the model, data type: DataFrame
+    :return: tuple of the classifier and the scaled features
+    """
+    if isinstance(model, Pipeline):
+        return model.steps[-1][1], model[:-1].transform(X)
+    # Models dumped without their scaler are scaled on the batch itself, their scores then depend on the batch,
+    #   the warning is printed once per model
+    if id(model) not in models_without_scaler:
+        models_without_scaler.add(id(model))
+        print('{}\tWarning: the model has no stored scaler, the features are scaled on the batch itself, '
+              'rebuild the model with 5.base_models.py to store its scaler'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return model, StandardScaler().fit_transform(X)
+
+
+# The models already warned about in scale_features
+models_without_scaler = set()
+
+
+model_registry = ModelRegistry('SDC_f1_s_jlib.pkl')
+
+###############################################################################
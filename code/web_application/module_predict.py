@@ -1,43 +1,64 @@
 # This module will be called by other modules and this should return the list of top 250
 # customers that are interested to buy the premium services based on various factors
 
-import joblib
 import datetime
+import os
+import threading
+from collections import OrderedDict
+import module_dep
+import module_model
+import numpy as np
 import pandas as pd
-from sklearn.preprocessing import StandardScaler
 
 pd.options.mode.chained_assignment = None
 
-def predict_cp(data_stream, prediction_date):
+# Number of potential customers in the prediction report
+top_k = 250
+
+feature_set_1 = ['transactions_amount', 'count_pay_attempt', 'nunique_beacon_type',
+                 'count_user_stay', 'count_buy_click', 'profile_submit_count',
+                 'sum_beacon_value']
+feature_set_4 = ['sum_beacon_value', 'count_pay_attempt', 'count_buy_click',
+                 'nunique_report_type', 'nunique_device', 'transactions_amount']
+
+feature_set_5 = ['count_pay_attempt', 'count_buy_click',
+                 'nunique_report_type', 'profile_submit_count']
+
+def top_k_positions(scores, keys, k):
     """
-    Function to generate the prediction report for a given date
-    :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
-    :param prediction_date: the date for which the prediction report is requested, data type: datetime.date object
-    :return: dataframe consisting of the top 250 potential customers
+    Function to get the positions of the k highest scores without sorting all of them
+    :param scores: the scores to rank, data type: numpy array
+    :param keys: the tie-breaking keys of the scores, lower keys rank first, data type: numpy array
+    :param k: the number of positions to keep, data type: int
+    :return: numpy array of the positions of the top k scores, ranked by score descending and key ascending
     """
+    if k <= 0:
+        return np.array([], dtype=int)
+    if k < len(scores):
+        # Partitioning on the k-th highest score, every score tied with it is kept as a candidate
+        kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= kth_score)
+    else:
+        candidates = np.arange(len(scores))
+    # Only the candidates are sorted, by score descending and then by key
+    return candidates[np.lexsort((keys[candidates], -scores[candidates]))][:k]
 
-    df_input = data_stream.get_data(prediction_date)
-    
-    # Loading the model
-    model_chosen = 'SDC_f1_s_jlib.pkl'
-    model = joblib.load(model_chosen)
-    
+
+def score_report(model, df_input, k=top_k):
+    """
+    Function to score the visits of a day with a model and keep the top k potential customers
+    :param model: the ml model, data type: Pipeline
+    :param df_input: the visits of the day, data type: DataFrame
+    :param k: the number of potential customers in the report, data type: int
+    :return: dataframe consisting of the top k potential customers, ranked by conversion probability
+    """
     # Preparing X's
     X = df_input.drop(columns=['date', 'email', 'conversion_status'])
-    
-    feature_set_1 = ['transactions_amount', 'count_pay_attempt', 'nunique_beacon_type',
-                     'count_user_stay', 'count_buy_click', 'profile_submit_count',
-                     'sum_beacon_value']
-    feature_set_4 = ['sum_beacon_value', 'count_pay_attempt', 'count_buy_click',
-                      'nunique_report_type', 'nunique_device', 'transactions_amount']
-    
-    feature_set_5 = ['count_pay_attempt', 'count_buy_click',
-                      'nunique_report_type', 'profile_submit_count']
-        
 
-    X_scaled = StandardScaler().fit_transform(X[feature_set_1])
+    # Scaling with the scaler fitted at training time, so that the scores don't depend on the batch
+    classifier, X_scaled = module_model.scale_features(model, X[module_model.model_features(model, feature_set_1)])
     # Getting the probabilities of X_scaled
-    y_hat = model.predict_proba(X_scaled)
+    y_hat = classifier.predict_proba(X_scaled)
     
     # Non-Ml baseline model
     # y_hat_base = base_predict_proba(X_base)
@@ -46,13 +67,177 @@ def predict_cp(data_stream, prediction_date):
     # Creating the prediction report with email and conversion_probability
     df_prediction_report = df_input[['email']]
     df_prediction_report['conversion_probability'] = y_hat[:, 1]
-    df_prediction_report.sort_values(by='conversion_probability', ascending=False, inplace=True)
 
-    # Filtering the Top-250 entries
-    df_prediction_report = df_prediction_report.iloc[:250, :]
+    # Filtering the Top-k entries, the customers with the same probability are ranked by email
+    df_prediction_report = df_prediction_report.iloc[top_k_positions(y_hat[:, 1], df_prediction_report.email.values, k)]
+    return df_prediction_report
+
+
+def predict_cp(data_stream, prediction_date, k=top_k):
+    """
+    Function to generate the prediction report for a given date
+    :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
+    :param prediction_date: the date for which the prediction report is requested, data type: datetime.date object
+    :param k: the number of potential customers in the report, data type: int
+    :return: dataframe consisting of the top k potential customers, ranked by conversion probability
+    """
+
+    df_input = data_stream.get_data(prediction_date)
+    
+    # Getting the model from the in-memory registry, it is only reloaded when its file changes,
+    #   the key of the report is taken before, so a model updated meanwhile only makes the report miss
+    key = report_cache.report_key(prediction_date, k)
+    model = module_model.model_registry.get_model()
+    df_prediction_report = score_report(model, df_input, k)
     
     # Creating a csv of the report
-    filename_prediction_report = 'prediction_report_' + datetime.datetime.strftime(prediction_date, '%Y%m%d') + '.csv'
-    df_prediction_report.to_csv(filename_prediction_report, encoding='utf-8', index=False)
+    write_report(df_prediction_report, prediction_date, key)
+
+    return df_prediction_report.round(5)
+
+
+
+def predict_range(data_stream, start_date, end_date, k=top_k):
+    """
+    Function to generate the prediction reports of all the dates of a range, the rows of the range are
+    sliced at once and scored in a single call to the model
+    :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
+    :param start_date: first date of the range, data type: datetime.date object
+    :param end_date: last date of the range, data type: datetime.date object
+    :param k: the number of potential customers in each report, data type: int
+    :return: dict of datetime.date object -> dataframe consisting of the top k potential customers of that date
+    """
+    df_input = data_stream.get_range(start_date, end_date)
+    if df_input.shape[0] == 0:
+        return {}
+
+    # Scoring all the dates of the range at once
+    keys = {prediction_date: report_cache.report_key(prediction_date, k) for prediction_date in module_dep.date_list(start_date, end_date)}
+    model = module_model.model_registry.get_model()
+    classifier, X_scaled = module_model.scale_features(model, df_input[module_model.model_features(model, feature_set_1)])
+    y_hat = classifier.predict_proba(X_scaled)
+
+    df_scores = df_input[['email']]
+    df_scores['conversion_probability'] = y_hat[:, 1]
+    emails = df_scores.email.values
+
+    # The rows of the range are sorted by date, each date is ranked on its own rows
+    prediction_reports = {}
+    for prediction_date, rows in module_dep.date_ranges(df_input.date.values).items():
+        df_prediction_report = df_scores.iloc[rows]
+        df_prediction_report = df_prediction_report.iloc[top_k_positions(y_hat[rows, 1], emails[rows], k)]
+        write_report(df_prediction_report, prediction_date, keys[prediction_date])
+        prediction_reports[prediction_date] = df_prediction_report.round(5)
+
+    return prediction_reports
+
+
+def report_filename(prediction_date):
+    return 'prediction_report_' + datetime.datetime.strftime(prediction_date, '%Y%m%d') + '.csv'
+
+
+def report_key_filename(prediction_date):
+    return 'prediction_report_' + datetime.datetime.strftime(prediction_date, '%Y%m%d') + '.key'
+
+
+def write_report(df_prediction_report, prediction_date, key):
+    """
+    Function to write the csv of a prediction report with the key of the model and k it was generated with
+    :param df_prediction_report: the prediction report, data type: DataFrame
+    :param prediction_date: the date of the report, data type: datetime.date object
+    :param key: the key of the report, from PredictionReportCache.report_key, data type: str
+    :return: None
+    """
+    # The old key is removed first, so that an interrupted write never pairs a key with another report
+    if os.path.isfile(report_key_filename(prediction_date)):
+        os.remove(report_key_filename(prediction_date))
+    df_prediction_report.to_csv(report_filename(prediction_date), encoding='utf-8', index=False)
+    with open(report_key_filename(prediction_date), 'w') as f:
+        f.write(key)
+    return None
+
+
+class PredictionReportCache:
+    """
+    Cache of the prediction reports keyed by prediction date and model version, the reports are served
+    from memory or from their csv file until the model file is updated by the incremental training
+    """
+
+    max_cached_reports = 32
+
+    def __init__(self, model_registry):
+        self.model_registry = model_registry
+        self.reports = OrderedDict()
+        # The key of the report last served for each date
+        self.latest_keys = {}
+        self.lock = threading.Lock()
+
+    def report_key(self, prediction_date, k):
+        """
+        Function to get the key of a report, from the current version of the model file
+        :param prediction_date: the date of the report, data type: datetime.date object
+        :param k: the number of potential customers in the report, data type: int
+        :return: str identifying the report and the model it was generated with
+        """
+        mtime_ns, size = self.model_registry.file_version()
+        return '{} {} {} {}'.format(datetime.datetime.strftime(prediction_date, '%Y%m%d'), k, mtime_ns, size)
+
+    def get_report(self, data_stream, prediction_date, k=top_k):
+        """
+        Function to get the prediction report of a date, it is only generated if no report of the current model exists
+        :param data_stream: the object that lets us retrieve the input data, data type: module_dep.Datastream object
+        :param prediction_date: the date for which the prediction report is requested, data type: datetime.date object
+        :param k: the number of potential customers in the report, data type: int
+        :return: dataframe consisting of the top k potential customers, ranked by conversion probability
+        """
+        # The key is taken before predicting, so a model updated meanwhile only makes the report miss next time
+        key = self.report_key(prediction_date, k)
+        filename_prediction_report = report_filename(prediction_date)
+        filename_report_key = report_key_filename(prediction_date)
+
+        with self.lock:
+            if key in self.reports:
+                self.reports.move_to_end(key)
+                self.latest_keys[prediction_date] = key
+                return self.reports[key].copy()
+
+        # The csv file is reused if it was written by another worker or before a restart with the same model
+        if os.path.isfile(filename_report_key) and os.path.isfile(filename_prediction_report):
+            with open(filename_report_key) as f:
+                key_on_disk = f.read()
+        else:
+            key_on_disk = None
+        if key_on_disk == key:
+            df_prediction_report = pd.read_csv(filename_prediction_report).round(5)
+        else:
+            df_prediction_report = predict_cp(data_stream, prediction_date, k)
+
+        with self.lock:
+            self.reports[key] = df_prediction_report
+            self.latest_keys[prediction_date] = key
+            # Evicting the least recently used reports
+            while len(self.reports) > self.max_cached_reports:
+                self.reports.popitem(last=False)
+        return df_prediction_report.copy()
+
+    def last_report(self, prediction_date):
+        """
+        Function to get the report last served for a date, whatever the current model version
+        :param prediction_date: the date of the report, data type: datetime.date object
+        :return: dataframe of the report, or None if it is not in memory or another worker wrote a newer one
+        """
+        with self.lock:
+            key = self.latest_keys.get(prediction_date)
+            df_prediction_report = self.reports.get(key)
+        if df_prediction_report is None:
+            return None
+        filename_report_key = report_key_filename(prediction_date)
+        if not os.path.isfile(filename_report_key):
+            return None
+        with open(filename_report_key) as f:
+            if f.read() != key:
+                return None
+        return df_prediction_report.copy()
+
 
-    return df_prediction_report.round(5)
\ No newline at end of file
+report_cache = PredictionReportCache(module_model.model_registry)
\ No newline at end of file
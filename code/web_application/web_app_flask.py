@@ -9,14 +9,21 @@ import module_predict
 import module_inc_train
 import pandas as pd
 
-data_stream = module_dep.DataStream()
+# The data backend, one of:
+#   'memory': each worker holds the whole base data in memory
+#   'lazy': each worker only loads the requested dates from the date partitions built by module_dep.py
+#   'shared': the workers map the columns published by module_dep.py, sharing a single copy of the base data
+data_backend = 'memory'
+data_streams = {'memory': module_dep.DataStream, 'lazy': module_dep.LazyDataStream, 'shared': module_dep.SharedDataStream}
+
+data_stream = data_streams[data_backend]()
 data_stream.initialize_data()
 app = Flask(__name__)
 
 app.config['SECRET_KEY'] = '#$%^&*'
 
 class InfoForm(FlaskForm):
-    report_type = RadioField('Report Type', choices=[('Prediction Report','Prediction Report'),('Predicted v/s Actual Report','Predicted v/s Actual report')])
+    report_type = RadioField('Report Type', choices=[('Prediction Report','Prediction Report'),('Predicted v/s Actual Report','Predicted v/s Actual report'),('Threshold Sweep','Threshold Sweep')])
     report_date = DateField('Report Date', format='%Y-%m-%d', validators=(validators.DataRequired(),))
     submit = SubmitField('Submit')
 
@@ -29,14 +36,23 @@ def index():
     if form.validate_on_submit():
 
         if form.report_type.data=='Prediction Report':
-            df_prediction_report = module_predict.predict_cp(data_stream, form.report_date.data)
-            df_prediction_report.sort_values(by='conversion_probability', ascending=False, inplace=True)
+            # The report is only generated again if the model was updated since it was last requested
+            df_prediction_report = module_predict.report_cache.get_report(data_stream, form.report_date.data)
             df_prediction_report.reset_index(drop=True, inplace=True)
             form.report = ""
-            print("Incremental training begins...")
-            module_inc_train.inc_train(data_stream, form.report_date.data)
+            # The incremental training runs in the background, the request only waits for the prediction
+            module_inc_train.training_queue.submit(data_stream, form.report_date.data)
             return render_template('index.html', form=form, tables=[df_prediction_report.to_html(classes='data')], titles=df_prediction_report.columns.values)
 
+        elif form.report_type.data=='Threshold Sweep':
+            # The metrics of every threshold of the report, to choose the operating point by capacity
+            sweep_report = module_PvA.sweep_reports(data_stream, {form.report_date.data: None})
+            if type(sweep_report)==str:
+                df_sweep_report = pd.DataFrame({'': [sweep_report]})
+            else:
+                df_sweep_report = sweep_report.round(4)
+            return render_template('index.html', form=form, tables=[df_sweep_report.to_html(classes='data')], titles=df_sweep_report.columns.values)
+
         else:
             pva_report = module_PvA.evaluate_report(data_stream, form.report_date.data)
             if type(pva_report)==str: